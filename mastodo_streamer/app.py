@@ -1,10 +1,12 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, jsonify, request, send_file, Response
+import logging
 import threading
 import os
 import json
 import time
-from mastodon_listener import start_stream_for_instance
 from config import Config
+from sharding import ShardSupervisor, start_streams
+from metrics import registry, render_prometheus
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
@@ -13,6 +15,8 @@ app = Flask(__name__)
 dotenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
 load_dotenv(dotenv_path)
 
+logging.basicConfig(level=Config.get_logging_config()['level'], format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
 mongo_uri = os.getenv('MONGO_URI')
 mongo_db_name = os.getenv('MONGO_DB_B')
 
@@ -20,14 +24,23 @@ mongo_db_name = os.getenv('MONGO_DB_B')
 mongo_client = MongoClient(mongo_uri)  # Use for Docker
 db = mongo_client[mongo_db_name]
 
+# Set when the instances are streamed by worker processes (STREAM_WORKERS > 1)
+supervisor = None
+
 
 # Function to start streaming for all configured Mastodon instances
 def start_streaming_for_all_instances():
+    global supervisor
     instances_config = Config.get_instance_config()  # Load instances from the .env file
-    for instance_config in instances_config:
-        stream_thread = threading.Thread(target=start_stream_for_instance, args=(instance_config,), name=instance_config['base_url'])
-        stream_thread.daemon = True
-        stream_thread.start()
+    stream_config = Config.get_stream_config()
+
+    if stream_config['workers'] > 1:
+        # Spread the instances over worker processes so JSON parsing isn't bound to one GIL
+        supervisor = ShardSupervisor(instances_config, stream_config['workers'], stream_config)
+        supervisor.start()
+        return
+
+    start_streams(instances_config, stream_config)
 
 
 @app.route('/')
@@ -51,6 +64,22 @@ def get_threads():
 
     return jsonify(thread_list), 200
 
+@app.route("/workers", methods=["GET"])
+def get_workers():
+    if supervisor is None:
+        return jsonify([]), 200
+    return jsonify(supervisor.workers()), 200
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    # Prometheus text format by default, JSON with ?format=json or an application/json Accept header
+    snapshot = registry.snapshot()
+    if supervisor is not None:
+        snapshot.update(supervisor.snapshot())
+    if request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json":
+        return jsonify(snapshot), 200
+    return Response(render_prometheus(snapshot), mimetype="text/plain; version=0.0.4"), 200
+
 @app.route("/collections", methods=["GET"])
 def list_collections():
     try:
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from config import Config
+from mastodon_listener import MastodonListener
+from status_writer import SharedWriter
+from stream_recovery import Backoff, select_missed, TIMELINE_PAGE_SIZE
+from structured_log import log_event
+
+
+class AsyncStreamer:
+    """Multiplexes the local public SSE stream of every instance on one asyncio event loop.
+
+    The loop only moves bytes. JSON decoding and building the status documents
+    happen on a small thread pool, and the MongoDB writes of all listeners are
+    batched by one SharedWriter thread.
+    """
+
+    def __init__(self, instances_config, parse_workers=4, read_timeout=90):
+        self.instances_config = instances_config
+        self.read_timeout = read_timeout
+        self.parse_pool = ThreadPoolExecutor(max_workers=parse_workers, thread_name_prefix="stream-parser")
+        self.recovery_config = Config.get_recovery_config()
+        self.shared_writer = None
+        self._backfill_tasks = set()  # Keeps running backfills referenced until they finish
+
+    def start(self):
+        """Run the event loop on a background thread so Flask can keep the main thread."""
+        thread = threading.Thread(target=self.run, name="asyncio-streamer", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        self.shared_writer = SharedWriter()
+        asyncio.run(self._stream_all())
+
+    async def _stream_all(self):
+        # Mastodon sends a heartbeat comment every few seconds, so a silent socket means a dead stream
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=self.read_timeout)
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            await asyncio.gather(*(
+                self._supervise_instance(session, instance_config) for instance_config in self.instances_config
+            ))
+
+    async def _supervise_instance(self, session, instance_config):
+        """Run one instance's stream and restart it if it dies, so a failure never ends the other instances' streams."""
+        loop = asyncio.get_running_loop()
+        backoff = Backoff(self.recovery_config['backoff_base'], self.recovery_config['backoff_max'])
+        listener = None
+        while True:
+            try:
+                if listener is None:
+                    listener = await loop.run_in_executor(self.parse_pool, MastodonListener,
+                                                          instance_config["collection_name"], self.shared_writer)
+                await self._stream_instance(session, instance_config, listener)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # E.g. the listener could not be created; _stream_instance only handles connection errors itself
+                delay = backoff.next_delay()
+                log_event("stream_task_failed", logging.ERROR, instance=instance_config['base_url'],
+                          error=repr(e), restart_in_seconds=round(delay, 1))
+                await asyncio.sleep(delay)
+
+    async def _stream_instance(self, session, instance_config, listener):
+        loop = asyncio.get_running_loop()
+        headers = {"Authorization": f"Bearer {instance_config['access_token']}"}
+        backoff = Backoff(self.recovery_config['backoff_base'], self.recovery_config['backoff_max'])
+        backfill_slots = asyncio.Semaphore(self.recovery_config['backfill_concurrency'])
+
+        while True:
+            since_id = listener.last_status_id
+            listener.begin_connection()
+            try:
+                url = await self._streaming_url(session, instance_config)
+                async with session.get(url, headers=headers) as response:
+                    response.raise_for_status()
+                    async for payload in self._iter_updates(response):
+                        if not listener.alive:
+                            listener.mark_alive()
+                            if since_id is not None:
+                                task = asyncio.ensure_future(self._backfill(session, instance_config, headers, listener, since_id, backfill_slots))
+                                self._backfill_tasks.add(task)
+                                task.add_done_callback(self._backfill_tasks.discard)
+                        if payload is not None:
+                            await loop.run_in_executor(self.parse_pool, self._dispatch, listener, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event("stream_error", logging.WARNING, instance=instance_config['base_url'], error=str(e))
+
+            if listener.alive:
+                backoff.reset()
+            delay = backoff.next_delay()
+            listener.metrics.record_reconnect()
+            log_event("stream_reconnect", instance=instance_config['base_url'], delay_seconds=round(delay, 1))
+            await asyncio.sleep(delay)
+
+    async def _backfill(self, session, instance_config, headers, listener, since_id, backfill_slots):
+        """Page through the local public timeline for statuses posted while the stream was down."""
+        loop = asyncio.get_running_loop()
+        url = f"{instance_config['base_url'].rstrip('/')}/api/v1/timelines/public"
+        async with backfill_slots:
+            min_id, total = since_id, 0
+            try:
+                for _ in range(self.recovery_config['backfill_max_pages']):
+                    params = {"local": "true", "min_id": str(min_id), "limit": str(TIMELINE_PAGE_SIZE)}
+                    async with session.get(url, params=params, headers=headers) as response:
+                        response.raise_for_status()
+                        body = await response.read()
+                    page = await loop.run_in_executor(self.parse_pool, json.loads, body)
+                    statuses, min_id, done = select_missed(page, listener.resume_id)
+                    await loop.run_in_executor(self.parse_pool, listener.store_many, statuses)
+                    total += len(statuses)
+                    if done:
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event("backfill_error", logging.WARNING, instance=instance_config['base_url'], since_id=since_id, error=str(e))
+            log_event("backfill_done", collection=listener.collection.name, since_id=since_id, statuses=total)
+
+    async def _streaming_url(self, session, instance_config):
+        # Most instances serve the streaming API from a separate host, advertised in the instance info
+        base_url = instance_config["base_url"].rstrip("/")
+        async with session.get(f"{base_url}/api/v1/instance") as response:
+            response.raise_for_status()
+            instance = await response.json()
+
+        streaming_api = (instance.get("urls") or {}).get("streaming_api") or base_url
+        streaming_api = streaming_api.replace("wss://", "https://", 1).replace("ws://", "http://", 1)
+        return f"{streaming_api.rstrip('/')}/api/v1/streaming/public/local"
+
+    @staticmethod
+    async def _iter_updates(response):
+        """Yield the raw data of every `update` event in a server-sent event stream, and None for heartbeats."""
+        buffer = b""
+        event, data_lines = None, []
+        async for chunk in response.content.iter_any():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line = line.rstrip(b"\r")
+                if not line:
+                    if event == "update" and data_lines:
+                        yield b"\n".join(data_lines)
+                    event, data_lines = None, []
+                elif line.startswith(b":"):
+                    yield None  # heartbeat / comment
+                elif line.startswith(b"event:"):
+                    event = line[6:].strip().decode()
+                elif line.startswith(b"data:"):
+                    data_lines.append(line[5:].lstrip(b" "))
+
+    @staticmethod
+    def _dispatch(listener, payload):
+        try:
+            listener.on_update(json.loads(payload))
+        except Exception as e:
+            log_event("update_error", logging.WARNING, collection=listener.collection.name, error=str(e))
@@ -0,0 +1,66 @@
+import itertools
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+LANGUAGES = (("en", 0.55), ("ja", 0.12), ("de", 0.08), ("fr", 0.06), ("es", 0.05), ("ko", 0.03), (None, 0.11))
+VISIBILITIES = (("public", 0.85), ("unlisted", 0.12), ("private", 0.03))
+
+
+def instance_shares(num_instances, exponent=1.0):
+    """Share of the total volume per instance; a few large instances carry most of it, like the tracked ones."""
+    weights = [1 / rank ** exponent for rank in range(1, num_instances + 1)]
+    return [weight / sum(weights) for weight in weights]
+
+
+class StatusGenerator:
+    """Synthetic statuses of one Mastodon instance.
+
+    Accounts post with Zipf-distributed frequency (exponent `zipf_exponent`), so a
+    few accounts write a large part of the statuses and most write rarely, as on
+    real instances. `bot_share` of the accounts are bots. Timestamps within a day
+    follow a diurnal curve with its peak at `peak_hour` UTC. Ids are seconds << 32
+    | a per-generator counter: they sort by time like Mastodon's snowflakes, fit
+    in an int64 and are unique even when random timestamps share a millisecond.
+    """
+
+    def __init__(self, instance, users=50000, zipf_exponent=1.1, bot_share=0.05, peak_hour=18, seed=0):
+        self.instance = instance
+        self._random = random.Random(f"{seed}:{instance}")
+        self._users = list(range(1, users + 1))
+        self._user_weights = list(itertools.accumulate(1 / rank ** zipf_exponent for rank in self._users))
+        self._bots = set(self._random.sample(self._users, int(users * bot_share)))
+        self._hour_weights = list(itertools.accumulate(
+            1 + 0.6 * math.cos((hour - peak_hour) / 24 * 2 * math.pi) for hour in range(24)
+        ))
+        self._sequence = itertools.count()
+
+    def _pick(self, choices):
+        value, threshold = None, self._random.random()
+        for value, share in choices:
+            threshold -= share
+            if threshold <= 0:
+                break
+        return value
+
+    def status(self, created_at=None):
+        """One status as the streaming API delivers it (decoded JSON)."""
+        created_at = created_at or datetime.now(timezone.utc)
+        user_id = self._random.choices(self._users, cum_weights=self._user_weights)[0]
+        return {
+            "id": str(int(created_at.timestamp()) << 32 | next(self._sequence)),
+            "created_at": created_at.strftime("%Y-%m-%dT%H:%M:%S.") + f"{created_at.microsecond // 1000:03d}Z",
+            "account": {"id": str(user_id), "username": f"user{user_id}", "bot": user_id in self._bots},
+            "visibility": self._pick(VISIBILITIES),
+            "language": self._pick(LANGUAGES),
+            "content": "<p>benchmark</p>",
+        }
+
+    def statuses_between(self, count, start, end):
+        """Yield `count` statuses spread over [start, end) with the diurnal curve, in no particular order."""
+        days = max(1, (end - start).days)
+        for _ in range(count):
+            hour = self._random.choices(range(24), cum_weights=self._hour_weights)[0]
+            created_at = start + timedelta(days=self._random.randrange(days), hours=hour,
+                                           seconds=self._random.random() * 3600)
+            yield self.status(min(created_at, end - timedelta(microseconds=1)))
@@ -0,0 +1,257 @@
+"""Benchmarks of the ingest path, the analytics job and the dashboard callbacks against a local mongod.
+
+    python benchmarks/run.py ingest --instances 4 --rate 2000 --duration 60
+    python benchmarks/run.py analytics --sizes 1000000 10000000 50000000
+    python benchmarks/run.py dashboard
+    python benchmarks/run.py all
+
+Everything runs in the bench_raw and bench_analytics databases of MONGO_URI
+(default mongodb://localhost:27017), which are dropped first. Results go to
+benchmarks/results/<UTC timestamp>.json. `dashboard` reads what the last
+`analytics` run left in bench_analytics; `all` runs ingest last, because its
+stream threads keep running until the process exits.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+STREAMER_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path[:0] = [BENCHMARKS_DIR, STREAMER_DIR, os.path.join(STREAMER_DIR, "data-transformer")]
+sys.path.append(os.path.join(STREAMER_DIR, "dash-app"))  # Last: its app.py must not shadow the streamer's
+
+RAW_DB = "bench_raw"
+ANALYTICS_DB = "bench_analytics"
+
+# The streamer, transformer and dashboard read their databases from the environment on import
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ["MONGO_DB_B"] = RAW_DB
+os.environ["MONGO_DB_A"] = ANALYTICS_DB
+
+from pymongo import MongoClient  # noqa: E402
+
+from generator import StatusGenerator, instance_shares  # noqa: E402
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "mean": round(statistics.fmean(ordered), 4),
+        "p50": round(ordered[len(ordered) // 2], 4),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+        "max": round(ordered[-1], 4),
+        "samples": len(ordered),
+    }
+
+
+def drop_bench_databases(client):
+    client.drop_database(RAW_DB)
+    client.drop_database(ANALYTICS_DB)
+
+
+def instance_names(num_instances):
+    return [f"https://bench{i}.example" for i in range(1, num_instances + 1)]
+
+
+def bench_ingest(client, args):
+    """Stream synthetic statuses from the SSE stand-in through the real listener and writer into MongoDB."""
+    from sse_server import StreamingStandIn
+    from sharding import start_streams
+    from metrics import registry
+
+    drop_bench_databases(client)
+    names = [f"instance{i}" for i in range(1, args.instances + 1)]
+    stand_in = StreamingStandIn(names, args.rate, port=args.port).start()
+    instances_config = [{"access_token": "bench", "base_url": stand_in.base_url(name),
+                         "collection_name": stand_in.base_url(name)} for name in names]
+    start_streams(instances_config, {"mode": args.mode, "parse_workers": args.parse_workers})
+
+    time.sleep(args.warmup)
+    raw_db = client[RAW_DB]
+
+    def written():
+        return sum(values["written_total"] for values in registry.snapshot().values())
+
+    lags, started, written_before = [], time.monotonic(), written()
+    while time.monotonic() - started < args.duration:
+        time.sleep(1)
+        now = datetime.now(timezone.utc)
+        # End-to-end lag: now minus created_at of the newest stored status of every instance
+        for collection_name in raw_db.list_collection_names(filter={"name": {"$not": {"$regex": "^system\\."}}}):
+            newest = raw_db[collection_name].find_one({}, sort=[("_id", -1)])
+            if newest:
+                created_at = (newest.get("created_at") or newest.get("t")).replace(tzinfo=timezone.utc)
+                lags.append((now - created_at).total_seconds())
+    elapsed = time.monotonic() - started
+    written_during = written() - written_before
+
+    snapshot = registry.snapshot()
+    return {
+        "mode": args.mode,
+        "instances": args.instances,
+        "offered_statuses_per_second": args.rate,
+        "duration_seconds": round(elapsed, 1),
+        "written_statuses_per_second": round(written_during / elapsed, 1),
+        "received_total": sum(values["received_total"] for values in snapshot.values()),
+        "written_total": sum(values["written_total"] for values in snapshot.values()),
+        "end_to_end_lag_seconds": percentiles(lags),
+    }
+
+
+def load_statuses(client, size, num_instances, days, layout):
+    """Insert `size` synthetic statuses over the last `days` finished days; returns statuses/sec of the load."""
+    from mastodon_listener import build_status_document
+    from raw_schema import COMPACT, ensure_indexes, prepare_collection, to_compact
+
+    raw_db = client[RAW_DB]
+    end = datetime.combine(datetime.now(timezone.utc).date(), datetime.min.time(), tzinfo=timezone.utc)
+    start = end - timedelta(days=days)
+    started = time.monotonic()
+    for name, share in zip(instance_names(num_instances), instance_shares(num_instances)):
+        instance_layout = prepare_collection(raw_db, name, layout == "compact")
+        collection = raw_db[name]
+        generator = StatusGenerator(name)
+        batch = []
+        for status in generator.statuses_between(int(size * share), start, end):
+            document = build_status_document(status)
+            batch.append(to_compact(document, name) if instance_layout == COMPACT else document)
+            if len(batch) == 10000:
+                collection.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            collection.insert_many(batch, ordered=False)
+        ensure_indexes(collection, instance_layout)
+    return round(size / (time.monotonic() - started), 1)
+
+
+def bench_analytics(client, args):
+    """Time the nightly analytics run (update_analytics.main) at every size."""
+    os.environ["ANALYTICS_LOOKBACK_DAYS"] = str(args.days)
+    import update_analytics
+
+    results = []
+    for size in args.sizes:
+        drop_bench_databases(client)
+        load_rate = load_statuses(client, size, args.instances, args.days, args.layout)
+        started = time.monotonic()
+        totals = update_analytics.main()
+        results.append({
+            "statuses": size,
+            "instances": args.instances,
+            "days": args.days,
+            "layout": args.layout,
+            "workers": update_analytics.analytics_workers,
+            "load_statuses_per_second": load_rate,
+            "job_seconds": round(time.monotonic() - started, 3),
+            **totals,
+        })
+    return results
+
+
+def bench_dashboard(client, args):
+    """Time the Data and Correlation tab callbacks, called directly, over the last 7, 30 and 90 days.
+
+    The first call of every combination computes the result, later calls may be served by the dashboard's cache.
+    The Data tab's figures and its SMA are computed in the browser, so only the series it is sent are timed.
+    """
+    spec = importlib.util.spec_from_file_location("dash_app", os.path.join(STREAMER_DIR, "dash-app", "app.py"))
+    dash_app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(dash_app)
+    # Timing a function the app doesn't register would measure nothing the UI runs
+    registered = [getattr(entry.get("callback"), "__wrapped__", None) for entry in dash_app.app.callback_map.values()]
+    for name in ("update_data_series", "update_correlation_analysis"):
+        if not any(callback is getattr(dash_app, name) for callback in registered):
+            raise RuntimeError(f"{name} is not registered as a Dash callback")
+    # The module-level names are the callbacks as registered, the cache's memoize included
+    update_data_series = dash_app.update_data_series
+    update_correlation_analysis = dash_app.update_correlation_analysis
+
+    today = datetime.now(timezone.utc).date()
+    end_date = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+    results = []
+    for days in (7, 30, 90):
+        start_date = (today - timedelta(days=days)).strftime("%Y-%m-%d")
+        for name, callback, callback_args in [
+            ("update_data_series", update_data_series, (start_date, end_date)),
+            ("update_correlation_analysis", update_correlation_analysis, (start_date, end_date, [], "post_count")),
+        ]:
+            timings = []
+            for _ in range(args.repeats):
+                started = time.perf_counter()
+                callback(*callback_args)
+                timings.append(time.perf_counter() - started)
+            results.append({"callback": name, "days": days, "cold_seconds": round(timings[0], 4),
+                            "warm_seconds": percentiles(timings[1:])})
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=STREAMER_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmark", choices=["ingest", "analytics", "dashboard", "all"])
+    parser.add_argument("--instances", type=int, default=5)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<timestamp>.json)")
+
+    ingest = parser.add_argument_group("ingest")
+    ingest.add_argument("--rate", type=float, default=2000, help="statuses per second over all instances")
+    ingest.add_argument("--duration", type=float, default=60, help="measured seconds")
+    ingest.add_argument("--warmup", type=float, default=10, help="seconds before measuring")
+    ingest.add_argument("--mode", choices=["threaded", "asyncio"], default="asyncio")
+    ingest.add_argument("--parse-workers", type=int, default=4)
+    ingest.add_argument("--port", type=int, default=8765)
+
+    analytics = parser.add_argument_group("analytics")
+    analytics.add_argument("--sizes", type=int, nargs="+", default=[1000000, 10000000, 50000000])
+    analytics.add_argument("--days", type=int, default=30)
+    analytics.add_argument("--layout", choices=["legacy", "compact"], default="legacy")
+
+    dashboard = parser.add_argument_group("dashboard")
+    dashboard.add_argument("--repeats", type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    client = MongoClient(os.environ["MONGO_URI"])
+    started_at = datetime.now(timezone.utc)
+    results = {
+        "started_at": started_at.isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "mongodb": client.server_info()["version"],
+        "arguments": vars(args),
+        "benchmarks": {},
+    }
+
+    selected = ["analytics", "dashboard", "ingest"] if args.benchmark == "all" else [args.benchmark]
+    for name in selected:
+        print(f"Running {name} benchmark...")
+        results["benchmarks"][name] = {"analytics": bench_analytics, "dashboard": bench_dashboard,
+                                       "ingest": bench_ingest}[name](client, args)
+        print(json.dumps(results["benchmarks"][name], indent=2))
+
+    output = args.output or os.path.join(BENCHMARKS_DIR, "results", started_at.strftime("%Y%m%dT%H%M%SZ") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as result_file:
+        json.dump(results, result_file, indent=2, default=str)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
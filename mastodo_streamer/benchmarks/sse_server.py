@@ -0,0 +1,114 @@
+"""Local stand-in for the Mastodon endpoints the streamer uses, serving synthetic statuses.
+
+Every instance lives under its own path prefix, http://HOST:PORT/<instance>, and
+serves /api/v1/instance, the local public SSE stream at `rate` statuses per
+second and an empty public timeline for backfills. Run it on its own with
+
+    python benchmarks/sse_server.py --instances 3 --rate 500
+"""
+import argparse
+import asyncio
+import json
+import threading
+
+from aiohttp import web
+
+from generator import StatusGenerator, instance_shares
+
+HEARTBEAT_INTERVAL = 10.0
+TICK = 0.01
+
+
+class StreamingStandIn:
+    def __init__(self, instances, rate, host="127.0.0.1", port=8765, seed=0):
+        """instances: names of the instances; rate: statuses per second over all of them, split like instance_shares."""
+        self.host = host
+        self.port = port
+        self.rates = dict(zip(instances, (rate * share for share in instance_shares(len(instances)))))
+        self.generators = {name: StatusGenerator(name, seed=seed) for name in instances}
+        self.sent = {name: 0 for name in instances}
+
+    def base_url(self, instance):
+        return f"http://{self.host}:{self.port}/{instance}"
+
+    def application(self):
+        app = web.Application()
+        for path, handler in [("/{instance}/api/v1/instance", self.instance_info),
+                              ("/{instance}/api/v1/streaming/public/local", self.stream),
+                              ("/{instance}/api/v1/timelines/public", self.timeline)]:
+            # Mastodon.py asks for some endpoints with a trailing slash (e.g. /api/v1/instance/)
+            app.router.add_get(path, handler)
+            app.router.add_get(path + "/", handler)
+        return app
+
+    def _instance(self, request):
+        instance = request.match_info["instance"]
+        if instance not in self.rates:
+            raise web.HTTPNotFound()
+        return instance
+
+    async def instance_info(self, request):
+        instance = self._instance(request)
+        return web.json_response({"uri": instance, "title": instance, "version": "4.2.0",
+                                  "urls": {"streaming_api": self.base_url(instance)}})
+
+    async def timeline(self, request):
+        self._instance(request)
+        return web.json_response([])
+
+    async def stream(self, request):
+        instance = self._instance(request)
+        generator, rate = self.generators[instance], self.rates[instance]
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        loop = asyncio.get_running_loop()
+        started = last_heartbeat = loop.time()
+        sent = 0
+        try:
+            while True:
+                now = loop.time()
+                due = int((now - started) * rate) - sent
+                if due > 0:
+                    chunk = "".join(f"event: update\ndata: {json.dumps(generator.status())}\n\n" for _ in range(due))
+                    await response.write(chunk.encode())
+                    sent += due
+                    self.sent[instance] += due
+                if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    await response.write(b":thump\n")
+                    last_heartbeat = now
+                await asyncio.sleep(TICK)
+        except ConnectionResetError:
+            pass  # the streamer disconnected
+        return response
+
+    def start(self):
+        """Serve on a background thread; returns once the port is bound."""
+        ready = threading.Event()
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            runner = web.AppRunner(self.application())
+            loop.run_until_complete(runner.setup())
+            loop.run_until_complete(web.TCPSite(runner, self.host, self.port).start())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, name="sse-stand-in", daemon=True).start()
+        ready.wait()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instances", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=500, help="statuses per second over all instances")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    stand_in = StreamingStandIn([f"instance{i}" for i in range(1, args.instances + 1)], args.rate, args.host, args.port)
+    for name in stand_in.rates:
+        print(f"{stand_in.base_url(name)} at {stand_in.rates[name]:.1f} statuses/s")
+    web.run_app(stand_in.application(), host=args.host, port=args.port)
@@ -24,4 +24,69 @@ class Config:
 
         return instances
 
+    @staticmethod
+    def get_writer_config():
+        # Write-behind buffer settings for MongoDB inserts
+        return {
+            'batch_size': int(os.getenv('WRITE_BATCH_SIZE', 500)),
+            'flush_interval': float(os.getenv('WRITE_FLUSH_INTERVAL', 1.0)),
+            'max_queue_size': int(os.getenv('WRITE_QUEUE_SIZE', 10000)),
+            'dedupe_cache_size': int(os.getenv('DEDUPE_CACHE_SIZE', 10000))
+        }
+
+    @staticmethod
+    def get_logging_config():
+        # Per-status events are summarised at most once per STATUS_LOG_INTERVAL seconds per instance
+        return {
+            'level': os.getenv('LOG_LEVEL', 'INFO').upper(),
+            'status_log_interval': float(os.getenv('STATUS_LOG_INTERVAL', 10.0))
+        }
+
+    @staticmethod
+    def get_stream_config():
+        # STREAM_MODE is either "threaded" (one thread per instance) or "asyncio" (one event loop for all instances).
+        # With STREAM_WORKERS > 1 the instances are split across that many processes, each using STREAM_MODE.
+        return {
+            'mode': os.getenv('STREAM_MODE', 'threaded').lower(),
+            'parse_workers': int(os.getenv('STREAM_PARSE_WORKERS', 4)),
+            'workers': int(os.getenv('STREAM_WORKERS', 1))
+        }
+
+    @staticmethod
+    def get_storage_config():
+        # STORAGE_LAYOUT=compact creates new instance collections as time-series collections with short keys
+        return {
+            'compact': os.getenv('STORAGE_LAYOUT', 'legacy').lower() == 'compact'
+        }
+
+    @staticmethod
+    def get_spill_config():
+        # Local disk spill for statuses MongoDB can't take right now; the size limits apply per instance
+        return {
+            'enabled': os.getenv('SPILL_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+            'directory': os.getenv('SPILL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spill')),
+            'max_bytes': int(float(os.getenv('SPILL_MAX_MB', 1024)) * 1024 * 1024),
+            'segment_bytes': int(float(os.getenv('SPILL_SEGMENT_MB', 16)) * 1024 * 1024),
+            'replay_batch_size': int(os.getenv('SPILL_REPLAY_BATCH_SIZE', 5000)),
+            'replay_interval': float(os.getenv('SPILL_REPLAY_INTERVAL', 5.0))
+        }
 
+    @staticmethod
+    def get_live_stats_config():
+        # Live per-day/per-hour analytics kept up to date by the writers; HLL_PRECISION trades memory for accuracy
+        return {
+            'enabled': os.getenv('LIVE_STATS_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+            'publish_interval': float(os.getenv('LIVE_STATS_INTERVAL', 5.0)),
+            'precision': int(os.getenv('HLL_PRECISION', 12)),
+            'legacy_output': os.getenv('ANALYTICS_LEGACY_OUTPUT', 'true').lower() in ('1', 'true', 'yes')
+        }
+
+    @staticmethod
+    def get_recovery_config():
+        # Reconnect backoff (seconds) and REST backfill limits per instance
+        return {
+            'backoff_base': float(os.getenv('RECONNECT_BACKOFF_BASE', 1.0)),
+            'backoff_max': float(os.getenv('RECONNECT_BACKOFF_MAX', 300.0)),
+            'backfill_concurrency': int(os.getenv('BACKFILL_CONCURRENCY', 1)),
+            'backfill_max_pages': int(os.getenv('BACKFILL_MAX_PAGES', 100))
+        }
@@ -1,16 +1,22 @@
 # dash_app/app.py
 import dash
 import os
-from dash import html, dcc, Input, Output
+from dash import html, dcc, ClientsideFunction, Input, Output
 from pymongo import MongoClient
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 import plotly.figure_factory as ff
-from datetime import datetime, timedelta
-import networkx as nx
+from datetime import datetime, timedelta, timezone
 import scipy as sp
+import scipy.cluster.hierarchy
+import scipy.spatial.distance
 from dotenv import load_dotenv
 
+import data_access
+from callback_cache import CallbackCache
+from network_layout import LayoutEngine
+
 dotenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
 load_dotenv(dotenv_path)
 
@@ -25,9 +31,43 @@ client = MongoClient(mongo_uri)
 analytics_db = client[mongo_db_name]
 
 # Collections
-postsperday_collection = analytics_db['postsperday']
-dailyactiveusers_collection = analytics_db['dailyactiveusers']
-averageuseractivity_collection = analytics_db['averageuseractivity']
+dailymetrics_collection = analytics_db['dailymetrics']  # One row per (date, instance) with every daily metric
+rollups_collection = analytics_db['rollups']  # Hourly, weekly and monthly metrics per (resolution, period, instance)
+correlations_collection = analytics_db['correlations']  # Spearman matrices of the standard windows, kept by the transformer
+
+# Callback results shared by all workers; a finished transformer run invalidates them
+callback_cache = CallbackCache(analytics_db['dashcache'], analytics_db['job_runs'],
+                               max_entries=int(os.getenv('DASH_CACHE_ENTRIES', 500)),
+                               ttl=int(os.getenv('DASH_CACHE_TTL', 3600)))
+
+# Positions of the correlation network, cached per correlation matrix and warm-started from the previous one
+layout_engine = LayoutEngine(spring_threshold=int(os.getenv('DASH_LAYOUT_SPRING_NODES', 150)))
+
+# Above this many instances the Correlation tab switches to its large mode: clustered order, no cell labels,
+# WebGL network traces and only the strongest edges (the top_k of every instance, above min_correlation)
+correlation_large_n = int(os.getenv('DASH_CORRELATION_LARGE_N', 40))
+network_top_k = int(os.getenv('DASH_NETWORK_TOP_K', 5))
+network_min_correlation = float(os.getenv('DASH_NETWORK_MIN_CORRELATION', 0))
+# In large mode the heatmap shows at most this many rows and columns; beyond that they are clusters of instances
+heatmap_max_size = int(os.getenv('DASH_HEATMAP_MAX_SIZE', 100))
+
+# Metrics shown on the Data tab, one chart each
+DATA_TAB_METRICS = ["post_count", "active_users", "avg_posts_per_user"]
+
+# Days averaged by the "Use 7-Day SMA" option
+SMA_WINDOW = 7
+
+# The Data tab shows the coarsest resolution that still gives the charts at least this many points;
+# with the SMA ticked it always shows days, which the SMA is computed over
+min_points = int(os.getenv('DASH_MIN_POINTS', 60))
+
+# Resolution -> (days per point, chart title suffix); weeks and months hold means per day
+RESOLUTIONS = {
+    "month": (30, "per Day (monthly mean)"),
+    "week": (7, "per Day (weekly mean)"),
+    "day": (1, "per Day"),
+    "hour": (1 / 24, "per Hour"),
+}
 
 # Metadata for instances
 instance_metadata = {
@@ -148,7 +188,7 @@ def render_tab_content(selected_tab):
                 dcc.DatePickerRange(
                     id="date-range-picker",
                     min_date_allowed=datetime(2024, 10, 24),
-                    max_date_allowed=(datetime.now() - timedelta(days=1)),
+                    max_date_allowed=datetime.now(),  # Today is filled in live by the streamer (estimated)
                     start_date=(datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d"),
                     end_date=(datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
                 ),
@@ -164,6 +204,9 @@ def render_tab_content(selected_tab):
                 ),
             ], style={"textAlign": "center", "margin-top": "50px", "font-family": "Arial, sans-serif"}),
 
+            # Series of the selected range; the graphs are drawn from it in the browser
+            dcc.Store(id="data-series-store"),
+
             # Graphs
             dcc.Graph(id="posts-line-chart", style={"width": "100%", "height": "600px"}),
             dcc.Graph(id="active-users-line-chart", style={"width": "100%", "height": "600px"}),
@@ -223,69 +266,150 @@ def render_tab_content(selected_tab):
         ])
 
 
+def choose_resolution(start_date, end_date):
+    days = (pd.to_datetime(end_date) - pd.to_datetime(start_date)).days + 1
+    for resolution, (days_per_point, _) in RESOLUTIONS.items():
+        if days / days_per_point >= min_points:
+            return resolution
+    return "hour"
+
+
+def hourly_rollups_cover(start_date, end_date):
+    """Whether every day of the range with daily metrics also has hourly rollups.
+
+    Hourly rollups only exist for days the transformer computed from the raw statuses
+    since they were introduced, so older ranges are shown per day instead.
+    """
+    daily = set(dailymetrics_collection.distinct("date", {"date": {"$gte": start_date, "$lte": end_date}}))
+    hourly = {period[:10] for period in rollups_collection.distinct(
+        "period", {"resolution": "hour", "period": {"$gte": start_date, "$lte": end_date + "T23"}}
+    )}
+    return daily <= hourly
+
+
+def includes_today(start_date, end_date, *args):
+    # Today's rows are updated live by the streamer, so they are never served from the cache
+    return not end_date or end_date >= datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+@callback_cache.memoize("metric_matrices", bypass=includes_today)
+def fetch_metric_matrices(start_date, end_date, resolution):
+    """Return the date × instance matrix of every Data tab metric in the range, in data_access's JSON form."""
+    if resolution == "day":
+        matrices = data_access.metric_matrices(
+            dailymetrics_collection, {"date": {"$gte": start_date, "$lte": end_date}}, DATA_TAB_METRICS
+        )
+        return data_access.matrices_to_json(matrices)
+
+    # Periods are keyed by their first day (or hour); include the week or month the range starts in
+    first_period = pd.to_datetime(start_date)
+    if resolution == "week":
+        first_period -= timedelta(days=first_period.weekday())
+    elif resolution == "month":
+        first_period = first_period.replace(day=1)
+    matrices = data_access.metric_matrices(
+        rollups_collection,
+        {"resolution": resolution, "period": {"$gte": first_period.strftime("%Y-%m-%d"), "$lte": end_date + "T23"}},
+        DATA_TAB_METRICS, date_field="period", resolution=resolution
+    )
+    return data_access.matrices_to_json(matrices)
+
+
 @app.callback(
-    [Output("posts-line-chart", "figure"),
-     Output("active-users-line-chart", "figure"),
-     Output("avg-user-activity-line-chart", "figure")],
+    Output("data-series-store", "data"),
     [Input("date-range-picker", "start_date"),
      Input("date-range-picker", "end_date"),
      Input("data-ema-toggle", "value")]
 )
-def update_data_charts(start_date, end_date, ema_option):
-    """Fetch precomputed post counts, active users, and avg user activity per day with optional SMA."""
+@callback_cache.memoize("data_series", bypass=includes_today)
+def update_data_series(start_date, end_date, ema_option):
+    """Ship the pivoted series of the Data tab to the browser, which draws them with or without the SMA.
+
+    Daily series start SMA_WINDOW - 1 days before start_date, so the SMA is defined from start_date on.
+    With the SMA ticked the series are always daily: weekly and monthly means have nothing left to smooth.
+    """
     if not start_date or not end_date:
-        empty_fig = go.Figure().update_layout(title="No Data Available", height=600)
-        return empty_fig, empty_fig, empty_fig
-
-    # Fetch Data
-    cursor = postsperday_collection.find({"date": {"$gte": start_date, "$lte": end_date}})
-    df_posts = pd.DataFrame(list(cursor))
-
-    cursor = dailyactiveusers_collection.find({"date": {"$gte": start_date, "$lte": end_date}})
-    df_users = pd.DataFrame(list(cursor))
-
-    cursor = averageuseractivity_collection.find({"date": {"$gte": start_date, "$lte": end_date}})
-    df_avg_activity = pd.DataFrame(list(cursor))
-
-    for df in [df_posts, df_users, df_avg_activity]:
-        if not df.empty:
-            df["date"] = pd.to_datetime(df["date"])
-
-    # Pivot Data
-    posts_per_day = df_posts.pivot(index="date", columns="instance", values="post_count").fillna(0) if not df_posts.empty else None
-    active_users_per_day = df_users.pivot(index="date", columns="instance", values="active_users").fillna(0) if not df_users.empty else None
-    avg_user_activity_per_day = df_avg_activity.pivot(index="date", columns="instance", values="avg_posts_per_user").fillna(0) if not df_avg_activity.empty else None
-
-    # Apply 7-day SMA if checkbox is checked
-    if "ema" in ema_option:
-        if posts_per_day is not None:
-            posts_per_day = posts_per_day.rolling(window=7, min_periods=7).mean().dropna()
-        if active_users_per_day is not None:
-            active_users_per_day = active_users_per_day.rolling(window=7, min_periods=7).mean().dropna()
-        if avg_user_activity_per_day is not None:
-            avg_user_activity_per_day = avg_user_activity_per_day.rolling(window=7, min_periods=7).mean().dropna()
-
-    # Create Figures
-    fig_posts, fig_users, fig_avg_activity = go.Figure(), go.Figure(), go.Figure()
-
-    for df, fig, title, y_title in [
-        (posts_per_day, fig_posts, "Number of Posts per Day", "Number of Posts"),
-        (active_users_per_day, fig_users, "Number of Active Users per Day", "Active Users"),
-        (avg_user_activity_per_day, fig_avg_activity, "Avg Posts Per User Per Day", "Avg Posts Per User"),
-    ]:
-        if df is not None:
-            for instance in df.columns:
-                fig.add_trace(go.Scatter(
-                    x=df.index,
-                    y=df[instance],
-                    mode="lines+markers",
-                    name=instance,
-                    hovertemplate=f"<b>{instance}</b><br>Date: %{{x}}<br>Value: %{{y}}<extra></extra>"
-
-                ))
-            fig.update_layout(title=title, yaxis_title=y_title, height=600)
-
-    return fig_posts, fig_users, fig_avg_activity
+        return None
+
+    # Fetch Data (one indexed range scan serves all three charts, already pivoted to date × instance)
+    resolution = "day" if "ema" in (ema_option or []) else choose_resolution(start_date, end_date)
+    if resolution == "hour" and not hourly_rollups_cover(start_date, end_date):
+        resolution = "day"
+    visible_from = None
+    fetch_from = start_date
+    if resolution == "day":
+        visible_from = start_date
+        fetch_from = (pd.to_datetime(start_date) - timedelta(days=SMA_WINDOW - 1)).strftime("%Y-%m-%d")
+
+    per_period = RESOLUTIONS[resolution][1]
+    return {
+        "metrics": fetch_metric_matrices(fetch_from, end_date, resolution),
+        "visible_from": visible_from,  # None: show every point, and the SMA doesn't apply (already averaged)
+        "sma_window": SMA_WINDOW,
+        "charts": [
+            {"metric": "post_count", "title": f"Number of Posts {per_period}", "y_title": "Number of Posts"},
+            {"metric": "active_users", "title": f"Number of Active Users {per_period}", "y_title": "Active Users"},
+            {"metric": "avg_posts_per_user", "title": f"Avg Posts Per User {per_period.replace('per', 'Per', 1)}",
+             "y_title": "Avg Posts Per User"},
+        ],
+    }
+
+
+# Figures of the Data tab, built in the browser (assets/data_charts.js); the SMA itself is computed there too
+app.clientside_callback(
+    ClientsideFunction(namespace="dashboard", function_name="dataCharts"),
+    [Output("posts-line-chart", "figure"),
+     Output("active-users-line-chart", "figure"),
+     Output("avg-user-activity-line-chart", "figure")],
+    [Input("data-series-store", "data"),
+     Input("data-ema-toggle", "value")]
+)
+
+
+def stored_correlation_matrix(start_date, end_date, sma, data_type):
+    """The transformer's precomputed matrix if the range is one of its standard windows, else None."""
+    stored = correlations_collection.find_one(
+        {"metric": data_type, "sma": sma, "start_date": start_date, "end_date": end_date},
+        {"_id": 0, "instances": 1, "matrix": 1}
+    )
+    if stored is None:
+        return None
+    instances = pd.Index(stored["instances"], name="instance")
+    return pd.DataFrame(stored["matrix"], index=instances, columns=instances, dtype=float)
+
+
+def cluster_linkage(correlation_matrix):
+    """Average-linkage hierarchical clustering of the instances on 1 - correlation."""
+    distances = (1 - correlation_matrix.fillna(0).to_numpy(dtype=float)).clip(0, 2)
+    np.fill_diagonal(distances, 0)
+    return sp.cluster.hierarchy.linkage(sp.spatial.distance.squareform(distances, checks=False), method="average")
+
+
+def cluster_order(correlation_matrix, linkage):
+    """Reorder rows and columns so that clustered instances are adjacent."""
+    order = correlation_matrix.columns[sp.cluster.hierarchy.leaves_list(linkage)]
+    return correlation_matrix.loc[order, order]
+
+
+def aggregate_clusters(correlation_matrix, linkage, max_size):
+    """Cut the clustering of correlation_matrix into at most max_size clusters; return the mean correlation between them.
+
+    Clusters come in cluster_order and are labelled by their first instance and the number of others in them.
+    """
+    labels = sp.cluster.hierarchy.fcluster(linkage, max_size, criterion="maxclust")
+    order = sp.cluster.hierarchy.leaves_list(linkage)
+    clusters = pd.unique(labels[order])
+    members = np.equal.outer(labels, clusters).astype(float)  # instance × cluster
+    values = correlation_matrix.to_numpy(dtype=float)
+    known = ~np.isnan(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = (members.T @ np.where(known, values, 0) @ members) / (members.T @ known @ members)
+    first = {}
+    for instance in order:
+        first.setdefault(labels[instance], correlation_matrix.columns[instance])
+    names = pd.Index([f"{first[cluster]} (+{int(members[:, k].sum()) - 1})" for k, cluster in enumerate(clusters)],
+                     name="instance")
+    return pd.DataFrame(means, index=names, columns=names)
 
 
 @app.callback(
@@ -297,79 +421,64 @@ def update_data_charts(start_date, end_date, ema_option):
      Input("ema-toggle", "value"),
      Input("data-type-selector", "value")]
 )
+@callback_cache.memoize("correlation_analysis", bypass=includes_today)
 def update_correlation_analysis(start_date, end_date, ema_option, data_type):
     if not start_date or not end_date:
-        return {}, {}
-
-    collection_map = {
-        "active_users": dailyactiveusers_collection,
-        "post_count": postsperday_collection,
-        "avg_posts_per_user": averageuseractivity_collection
-    }
-    selected_collection = collection_map[data_type]
-
-    cursor = selected_collection.find(
-        {"date": {"$gte": start_date, "$lte": end_date}},
-        {"_id": 0, "date": 1, "instance": 1, data_type: 1}
-    )
-    df_data = pd.DataFrame(list(cursor))
-
-    if df_data.empty:
-        return {}, {}
-
-    df_data["date"] = pd.to_datetime(df_data["date"])
-    selected_data_per_day = df_data.pivot(index="date", columns="instance", values=data_type).fillna(0)
-
-    if "ema" in ema_option:
-        selected_data_per_day = selected_data_per_day.rolling(window=7, min_periods=7).mean().dropna()
-
-    correlation_matrix = selected_data_per_day.corr(method='spearman')
+        return {}, {}, {}
 
+    correlation_matrix = stored_correlation_matrix(start_date, end_date, "ema" in ema_option, data_type)
+    if correlation_matrix is None:
+        matrices = data_access.metric_matrices(
+            dailymetrics_collection, {"date": {"$gte": start_date, "$lte": end_date}}, [data_type]
+        )
+        if not matrices:
+            return {}, {}, {}
+        selected_data_per_day = matrices[data_type]
+
+        if "ema" in ema_option:
+            selected_data_per_day = selected_data_per_day.rolling(window=7, min_periods=7).mean().dropna()
+
+        correlation_matrix = selected_data_per_day.corr(method='spearman')
+
+    large = len(correlation_matrix) > correlation_large_n
+    heatmap_matrix = correlation_matrix
+    if large:
+        linkage = cluster_linkage(correlation_matrix)
+        if len(correlation_matrix) > heatmap_max_size:
+            heatmap_matrix = aggregate_clusters(correlation_matrix, linkage, heatmap_max_size)
+        correlation_matrix = cluster_order(correlation_matrix, linkage)
+        if len(correlation_matrix) <= heatmap_max_size:
+            heatmap_matrix = correlation_matrix
+
+    # Cell labels are drawn by the heatmap trace itself (texttemplate), in a colour contrasting with the cell;
+    # in large mode there are none, values are rounded, and above heatmap_max_size instances the cells are
+    # clusters, so the figure stays small however many instances there are
     fig_heatmap = go.Figure(data=go.Heatmap(
-        z=correlation_matrix.values,
-        x=correlation_matrix.columns.tolist(),
-        y=correlation_matrix.index.tolist(),
+        z=heatmap_matrix.values.round(2).astype(np.float32) if large else heatmap_matrix.values,
+        x=heatmap_matrix.columns.tolist(),
+        y=heatmap_matrix.index.tolist(),
         colorscale="RdBu_r",
         zmin=-1, zmax=1,
         colorbar=dict(title="Correlation"),
-        hoverongaps=False
+        hoverongaps=False,
+        texttemplate=None if large else "%{z:.2f}"
     ))
 
-    annotations = []
-    for i in range(len(correlation_matrix.index)):
-        for j in range(len(correlation_matrix.columns)):
-            value = correlation_matrix.iloc[i, j]
-            annotations.append(
-                dict(
-                    x=correlation_matrix.columns[j],
-                    y=correlation_matrix.index[i],
-                    text=f"{value:.2f}",
-                    showarrow=False,
-                    font=dict(color="black" if abs(value) < 0.5 else "white"),
-                )
-            )
-
     fig_heatmap.update_layout(
         title=f"Spearman Correlation Matrix ({data_type.replace('_', ' ').title()}) {(' (7-Day SMA)' if 'ema' in ema_option else '')} ({start_date} to {end_date})",
         xaxis_title="Instance",
         yaxis_title="Instance",
-        annotations=annotations,
         height=800
     )
 
-    G = nx.Graph()
-    correlation_matrix_clipped = correlation_matrix.clip(lower=0)
-
-    epsilon = 0.01
-    for i, instance1 in enumerate(correlation_matrix_clipped.columns):
-        for j, instance2 in enumerate(correlation_matrix_clipped.columns):
-            if i != j:
-                weight = correlation_matrix_clipped.iloc[i, j]
-                if weight > 0:
-                    transformed_weight = 1 / (abs(weight) + epsilon)
-                    G.add_edge(instance1, instance2, weight=transformed_weight)
-
-    pos = nx.kamada_kawai_layout(G, weight="weight")
+    if large:
+        G, pos = layout_engine.layout(correlation_matrix, top_k=network_top_k, min_correlation=network_min_correlation)
+    else:
+        G, pos = layout_engine.layout(correlation_matrix)
+    # WebGL traces and hover-only labels keep hundreds of nodes responsive
+    scatter = go.Scattergl if large else go.Scatter
+    node_mode = "markers" if large else "markers+text"
+    node_size = 10 if large else 20
 
     edge_x, edge_y = [], []
     for edge in G.edges(data=True):
@@ -391,7 +500,7 @@ def update_correlation_analysis(start_date, end_date, ema_option, data_type):
 
     fig_network = go.Figure()
 
-    fig_network.add_trace(go.Scatter(
+    fig_network.add_trace(scatter(
         x=edge_x, y=edge_y,
         mode="lines",
         line=dict(width=0.5, color="gray"),
@@ -411,11 +520,11 @@ def update_correlation_analysis(start_date, end_date, ema_option, data_type):
 
     for lang, nodes in grouped_nodes.items():
         coords = grouped_coords[lang]
-        fig_network.add_trace(go.Scatter(
+        fig_network.add_trace(scatter(
             x=[x for x, y in coords],
             y=[y for x, y in coords],
-            mode="markers+text",
-            marker=dict(size=20, color=language_color_map.get(lang, '#1f77b4')),
+            mode=node_mode,
+            marker=dict(size=node_size, color=language_color_map.get(lang, '#1f77b4')),
             text=nodes,
             textposition="top center",
             hoverinfo="text",
@@ -444,7 +553,7 @@ def update_correlation_analysis(start_date, end_date, ema_option, data_type):
         grouped_tag_nodes[tag].append(node)
         grouped_tag_coords[tag].append((node_x[i], node_y[i]))
 
-    fig_network_tag.add_trace(go.Scatter(
+    fig_network_tag.add_trace(scatter(
         x=edge_x, y=edge_y,
         mode="lines",
         line=dict(width=0.5, color="gray"),
@@ -454,11 +563,11 @@ def update_correlation_analysis(start_date, end_date, ema_option, data_type):
 
     for tag, nodes in grouped_tag_nodes.items():
         coords = grouped_tag_coords[tag]
-        fig_network_tag.add_trace(go.Scatter(
+        fig_network_tag.add_trace(scatter(
             x=[x for x, y in coords],
             y=[y for x, y in coords],
-            mode="markers+text",
-            marker=dict(size=20, color=tag_color_map.get(tag, '#1f77b4')),
+            mode=node_mode,
+            marker=dict(size=node_size, color=tag_color_map.get(tag, '#1f77b4')),
             text=nodes,
             textposition="top center",
             hoverinfo="text",
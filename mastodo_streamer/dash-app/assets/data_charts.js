@@ -0,0 +1,52 @@
+// Figures of the Data tab, drawn from the series app.py puts in data-series-store.
+// The SMA is applied here; app.py ships daily series whenever it is ticked.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        dataCharts: function (series, emaOption) {
+            if (!series) {
+                const emptyFig = {data: [], layout: {title: {text: "No Data Available"}, height: 600}};
+                return [emptyFig, emptyFig, emptyFig];
+            }
+            // Coarser resolutions (visible_from is null) are already averaged
+            const useSma = (emaOption || []).includes("ema") && series.visible_from !== null;
+
+            return series.charts.map(function (chart) {
+                const matrix = series.metrics[chart.metric];
+                if (!matrix) {
+                    return {data: [], layout: {}};
+                }
+                const rows = useSma ? movingAverage(matrix.values, series.sma_window) : matrix.values;
+                // Rows before visible_from are only lookback for the SMA; rows without a full window are dropped
+                const shown = [];
+                rows.forEach(function (row, i) {
+                    if (row !== null && (series.visible_from === null || matrix.index[i] >= series.visible_from)) {
+                        shown.push(i);
+                    }
+                });
+                const x = shown.map(function (i) { return matrix.index[i]; });
+                const data = matrix.columns.map(function (instance, column) {
+                    return {
+                        type: "scatter",
+                        x: x,
+                        y: shown.map(function (i) { return rows[i][column]; }),
+                        mode: "lines+markers",
+                        name: instance,
+                        hovertemplate: "<b>" + instance + "</b><br>Date: %{x}<br>Value: %{y}<extra></extra>"
+                    };
+                });
+                return {data: data, layout: {title: {text: chart.title}, yaxis: {title: {text: chart.y_title}}, height: 600}};
+            });
+        }
+    }
+});
+
+// Trailing mean over `window` rows of a date × instance matrix; null for rows with fewer rows before them
+function movingAverage(values, window) {
+    const sums = new Array(values.length ? values[0].length : 0).fill(0);
+    return values.map(function (row, i) {
+        row.forEach(function (value, column) {
+            sums[column] += value - (i >= window ? values[i - window][column] : 0);
+        });
+        return i >= window - 1 ? sums.map(function (sum) { return sum / window; }) : null;
+    });
+}
@@ -0,0 +1,102 @@
+import functools
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import plotly.utils
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+# MongoDB documents are limited to 16 MB; larger results are simply not cached
+MAX_ENTRY_BYTES = 12 * 1024 * 1024
+
+
+class CallbackCache:
+    """LRU cache with a TTL for callback results, kept in MongoDB so every dashboard worker shares it.
+
+    Entries are keyed by the callback name, its arguments and the data version:
+    the finish time of the transformer's latest successful run in `job_runs`.
+    When a run finishes, the version changes, so new lookups miss and the entries
+    of older versions are deleted. Past `max_entries` the least recently used
+    entries are evicted, and a TTL index drops entries `ttl` seconds after they
+    were stored. Results are stored as JSON (figures through Plotly's encoder).
+    """
+
+    def __init__(self, collection, job_runs, max_entries=500, ttl=3600, version_interval=10.0):
+        self.collection = collection
+        self.job_runs = job_runs
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_interval = version_interval
+
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked = 0.0
+        self._indexes_ready = False
+
+    def data_version(self):
+        with self._lock:
+            if time.monotonic() - self._version_checked < self.version_interval:
+                return self._version
+            self._version_checked = time.monotonic()
+        run = self.job_runs.find_one({"status": "ok"}, {"finished_at": 1}, sort=[("finished_at", -1)])
+        version = run["finished_at"].isoformat() if run else "none"
+        with self._lock:
+            changed, self._version = version != self._version, version
+        if changed:
+            self.collection.delete_many({"version": {"$ne": version}})
+        return version
+
+    def _ensure_indexes(self):
+        if not self._indexes_ready:
+            self.collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+            self.collection.create_index([("last_used", ASCENDING)])
+            self._indexes_ready = True
+
+    def get_or_compute(self, name, args, compute):
+        try:
+            self._ensure_indexes()
+            version = self.data_version()
+            key = hashlib.sha1(json.dumps([name, args, version], default=str).encode("utf-8")).hexdigest()
+            now = datetime.now(timezone.utc)
+            entry = self.collection.find_one_and_update(
+                {"_id": key, "expires_at": {"$gt": now}}, {"$set": {"last_used": now}},
+                projection={"value": 1}, return_document=ReturnDocument.AFTER
+            )
+            if entry is not None:
+                return json.loads(entry["value"])
+        except PyMongoError:
+            return compute()  # A cache that can't be reached must not take the dashboard down
+
+        value = json.loads(json.dumps(compute(), cls=plotly.utils.PlotlyJSONEncoder))
+        self._store(key, version, now, value)
+        return value
+
+    def _store(self, key, version, now, value):
+        encoded = json.dumps(value)
+        if len(encoded) > MAX_ENTRY_BYTES:
+            return
+        try:
+            self.collection.insert_one({"_id": key, "version": version, "value": encoded, "last_used": now,
+                                        "expires_at": now + timedelta(seconds=self.ttl)})
+        except DuplicateKeyError:
+            return  # Another worker computed the same entry at the same time
+        except PyMongoError:
+            return
+        excess = self.collection.estimated_document_count() - self.max_entries
+        if excess > 0:
+            oldest = [entry["_id"] for entry in self.collection.find({}, {"_id": 1}).sort("last_used", ASCENDING).limit(excess)]
+            self.collection.delete_many({"_id": {"$in": oldest}})
+
+    def memoize(self, name, bypass=None):
+        """Decorator caching a callback's result; calls for which bypass(*args) is true are always computed."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args):
+                if bypass is not None and bypass(*args):
+                    return function(*args)
+                return self.get_or_compute(name, list(args), lambda: function(*args))
+            return wrapper
+        return decorator
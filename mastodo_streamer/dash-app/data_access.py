@@ -0,0 +1,51 @@
+"""Columnar loading of the analytics collections into date × instance matrices.
+
+Documents are decoded by pymongoarrow's C extension straight into Arrow columns,
+so no per-row dicts are built, and the pivot is one NumPy scatter.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow
+from pymongoarrow.api import Schema, find_arrow_all
+
+DATE_FORMATS = {"hour": "%Y-%m-%dT%H"}
+DEFAULT_DATE_FORMAT = "%Y-%m-%d"
+
+
+def load_columns(collection, query, date_field, metrics):
+    """Return {date_field, "instance", *metrics: NumPy array} for the matching documents."""
+    projection = {"_id": 0, date_field: 1, "instance": 1, **{metric: 1 for metric in metrics}}
+    schema = Schema({date_field: pyarrow.string(), "instance": pyarrow.string(),
+                     **{metric: pyarrow.float64() for metric in metrics}})
+    table = find_arrow_all(collection, query, schema=schema, projection=projection)
+    return {name: table.column(name).to_numpy(zero_copy_only=False) for name in schema.to_arrow().names}
+
+
+def pivot(dates, instances, values, date_format=DEFAULT_DATE_FORMAT):
+    """Scatter a long (date, instance, value) table into a date × instance DataFrame; missing cells are 0."""
+    date_keys, date_index = np.unique(dates.astype(str), return_inverse=True)
+    instance_keys, instance_index = np.unique(instances.astype(str), return_inverse=True)
+    matrix = np.zeros((len(date_keys), len(instance_keys)))
+    matrix[date_index, instance_index] = np.nan_to_num(values.astype(float))
+    return pd.DataFrame(matrix, index=pd.to_datetime(date_keys, format=date_format),
+                        columns=pd.Index(instance_keys, name="instance"))
+
+
+def metric_matrices(collection, query, metrics, date_field="date", resolution="day"):
+    """Return {metric: date × instance DataFrame} for the matching documents, read in one indexed scan.
+
+    All matrices share the same index and columns; the result is empty if nothing matches.
+    """
+    columns = load_columns(collection, query, date_field, metrics)
+    if not len(columns[date_field]):
+        return {}
+    date_format = DATE_FORMATS.get(resolution, DEFAULT_DATE_FORMAT)
+    return {metric: pivot(columns[date_field], columns["instance"], columns[metric], date_format) for metric in metrics}
+
+
+def matrices_to_json(matrices):
+    """JSON-friendly form of metric_matrices' result, e.g. for the callback cache."""
+    return {metric: {"index": [timestamp.isoformat() for timestamp in matrix.index],
+                     "columns": list(matrix.columns), "values": matrix.values.tolist()}
+            for metric, matrix in matrices.items()}
+
@@ -0,0 +1,117 @@
+"""Node positions for the correlation network graph.
+
+Edges come straight from the correlation matrix: every pair of instances with a
+positive correlation, with distance 1 / (correlation + epsilon), optionally
+thinned to the strongest correlations of every instance. Up to
+`spring_threshold` nodes the graph is laid out with Kamada-Kawai, which honours
+those distances; above it with Fruchterman-Reingold (spring_layout), which scales
+to many more nodes. Layouts are cached by the matrix they were computed from, and
+a matrix that differs only slightly from the previous one starts from the
+previous positions, so the graph does not jump between requests.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import networkx as nx
+import numpy as np
+
+EPSILON = 0.01
+SEED = 42
+
+
+def correlation_edges(correlation_matrix, epsilon=EPSILON, top_k=None, min_correlation=0.0):
+    """Return [(instance, instance, distance, correlation)] for every pair with a correlation above min_correlation.
+
+    With top_k, a pair is kept only if it is among the top_k correlations of one of its two instances.
+    """
+    values = correlation_matrix.to_numpy(dtype=float)
+    keep = values > max(min_correlation, 0)  # NaN (a constant series) compares False
+    np.fill_diagonal(keep, False)
+    if top_k and top_k < len(values) - 1:
+        scores = np.where(keep, values, -np.inf)
+        top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        selected = np.zeros_like(keep)
+        selected[np.arange(len(values))[:, None], top] = True
+        keep &= selected | selected.T
+    rows, columns = np.nonzero(np.triu(keep, k=1))
+    correlations = values[rows, columns]
+    names = np.asarray(correlation_matrix.columns)
+    return list(zip(names[rows], names[columns], (1 / (correlations + epsilon)).tolist(), correlations.tolist()))
+
+
+class LayoutEngine:
+    def __init__(self, spring_threshold=150, max_entries=64, warm_start_tolerance=0.1):
+        """spring_threshold: node count above which spring_layout replaces Kamada-Kawai;
+        warm_start_tolerance: largest mean absolute change of the shared correlations that still warm-starts."""
+        self.spring_threshold = spring_threshold
+        self.max_entries = max_entries
+        self.warm_start_tolerance = warm_start_tolerance
+
+        self._lock = threading.Lock()
+        self._layouts = OrderedDict()
+        self._previous = None  # (correlation matrix, positions) of the latest computed layout
+
+    @staticmethod
+    def _key(correlation_matrix, *edge_options):
+        digest = hashlib.sha1("\0".join(map(str, [*edge_options, *correlation_matrix.columns])).encode("utf-8"))
+        digest.update(np.round(correlation_matrix.to_numpy(dtype=float), 3).tobytes())
+        return digest.hexdigest()
+
+    def _initial_positions(self, correlation_matrix, nodes):
+        """Previous positions of `nodes` if the matrix changed only slightly since the previous layout, else None."""
+        if self._previous is None:
+            return None
+        previous_matrix, previous_positions = self._previous
+        shared = [node for node in nodes if node in previous_positions]
+        if len(shared) < 2:
+            return None
+        change = np.nanmean(np.abs(correlation_matrix.loc[shared, shared].to_numpy(dtype=float)
+                                   - previous_matrix.loc[shared, shared].to_numpy(dtype=float)))
+        if not change <= self.warm_start_tolerance:
+            return None
+        positions = {node: np.asarray(previous_positions[node]) for node in shared}
+        # Nodes new to the graph start next to their most correlated shared node (the centre if none correlates),
+        # each with its own seeded offset: coinciding nodes would make Kamada-Kawai divide by a zero distance
+        centre = np.mean(list(positions.values()), axis=0)
+        offset = 0.05 * max(np.ptp(list(positions.values()), axis=0).max(), 1e-3)
+        rng = np.random.default_rng(SEED)
+        for node in nodes:
+            if node in positions:
+                continue
+            correlations = correlation_matrix.loc[node, shared].to_numpy(dtype=float)
+            anchor = centre if np.isnan(correlations).all() else positions[shared[np.nanargmax(correlations)]]
+            positions[node] = anchor + rng.uniform(-offset, offset, size=len(anchor))
+        return positions
+
+    def layout(self, correlation_matrix, top_k=None, min_correlation=0.0):
+        """Return (graph, {instance: (x, y)}) for a Spearman correlation matrix; see correlation_edges for the options."""
+        graph = nx.Graph()
+        edges = correlation_edges(correlation_matrix, top_k=top_k, min_correlation=min_correlation)
+        for instance1, instance2, distance, correlation in edges:
+            graph.add_edge(instance1, instance2, weight=distance, correlation=correlation)
+        if not graph:
+            return graph, {}
+
+        key = self._key(correlation_matrix, top_k, min_correlation)
+        with self._lock:
+            positions = self._layouts.get(key)
+            if positions is not None:
+                self._layouts.move_to_end(key)
+                return graph, positions
+            initial = self._initial_positions(correlation_matrix, list(graph))
+
+        if len(graph) > self.spring_threshold:
+            # spring_layout pulls harder along heavier edges, so it gets the correlation rather than the distance
+            positions = nx.spring_layout(graph, pos=initial, weight="correlation", seed=SEED,
+                                         iterations=20 if initial else 50)
+        else:
+            positions = nx.kamada_kawai_layout(graph, pos=initial, weight="weight")
+        positions = {node: tuple(float(coordinate) for coordinate in position) for node, position in positions.items()}
+
+        with self._lock:
+            self._layouts[key] = positions
+            while len(self._layouts) > self.max_entries:
+                self._layouts.popitem(last=False)
+            self._previous = (correlation_matrix, positions)
+        return graph, positions
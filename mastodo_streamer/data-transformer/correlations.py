@@ -0,0 +1,44 @@
+"""Spearman correlation matrices between instances, as the dashboard's Correlation tab computes them.
+
+The dashboard pivots the daily rows of a range into a date × instance table (days
+and instances sorted, missing cells 0), optionally applies a 7-day SMA that drops
+the first six days, and calls pandas' corr(method="spearman"). The functions here
+reproduce that with NumPy, so stored matrices and live ones are the same.
+"""
+import numpy as np
+
+SMA_WINDOW = 7
+
+
+def pivot(rows, field):
+    """Return (dates, instances, date × instance array of `field`) for dailymetrics rows."""
+    dates = sorted({row["date"] for row in rows})
+    instances = sorted({row["instance"] for row in rows})
+    date_index = {date: i for i, date in enumerate(dates)}
+    instance_index = {instance: j for j, instance in enumerate(instances)}
+    values = np.zeros((len(dates), len(instances)))
+    for row in rows:
+        values[date_index[row["date"]], instance_index[row["instance"]]] = row.get(field) or 0
+    return dates, instances, values
+
+
+def moving_average(values, window=SMA_WINDOW):
+    """Trailing mean over `window` rows; the first window - 1 rows, which have no full window, are dropped."""
+    if len(values) < window:
+        return values[:0]
+    return np.lib.stride_tricks.sliding_window_view(values, window, axis=0).mean(axis=-1)
+
+
+def average_ranks(column):
+    """Ranks starting at 1, ties sharing the mean of their ranks (like pandas' rank())."""
+    _, inverse, counts = np.unique(column, return_inverse=True, return_counts=True)
+    return (np.cumsum(counts) - (counts - 1) / 2)[inverse]
+
+
+def spearman(values):
+    """Instance × instance Spearman correlation of the columns; NaN where a column is constant or too short."""
+    if len(values) < 2:
+        return np.full((values.shape[1], values.shape[1]), np.nan)
+    ranks = np.column_stack([average_ranks(column) for column in values.T])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.atleast_2d(np.corrcoef(ranks, rowvar=False))
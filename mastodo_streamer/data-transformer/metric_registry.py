@@ -0,0 +1,125 @@
+"""Metrics computed from the raw statuses of one instance in a single aggregation.
+
+Every registered metric is one branch of a $facet. All branches read the same
+stream of matched statuses, so adding a metric never adds a scan of the raw
+collection. Statuses reach the branches projected to the raw fields the metrics
+declare (under their legacy names, whatever the collection's layout), plus an
+`hour` ("YYYY-MM-DDTHH", UTC) and a `day` ("YYYY-MM-DD") key.
+"""
+
+DAY = "day"
+HOUR = "hour"
+
+
+class Metric:
+    """A metric of the raw statuses.
+
+    `fields` are the raw fields the metric reads, `stages` its $facet branch and
+    `collect(rows)` turns the branch's output into {period: {output field: value}},
+    where a period is a day or an hour depending on `resolution`.
+    """
+
+    def __init__(self, name, fields, stages, collect, resolution=DAY):
+        self.name = name
+        self.fields = fields
+        self.stages = stages
+        self.collect = collect
+        self.resolution = resolution
+
+
+METRICS = {}
+
+
+def register(metric):
+    METRICS[metric.name] = metric
+    return metric
+
+
+def build_pipeline(match, fields, metrics=None):
+    """Return the aggregation computing the given metrics (all registered ones by default) over the matched statuses.
+
+    `fields` maps the legacy raw field names to the names used by the collection's layout.
+    """
+    metrics = metrics or list(METRICS.values())
+    created_at = "$" + fields["created_at"]
+    needed = {field for metric in metrics for field in metric.fields}
+    return [
+        {"$match": match},
+        {"$project": {
+            "_id": 0,
+            **{field: "$" + fields[field] for field in sorted(needed)},
+            # Unmigrated legacy documents hold ISO strings in UTC, whose first 13 characters are the day and hour
+            "hour": {"$cond": [
+                {"$eq": [{"$type": created_at}, "string"]},
+                {"$substrBytes": [created_at, 0, 13]},
+                {"$dateToString": {"format": "%Y-%m-%dT%H", "date": created_at}}
+            ]}
+        }},
+        {"$addFields": {"day": {"$substrBytes": ["$hour", 0, 10]}}},
+        {"$facet": {metric.name: metric.stages for metric in metrics}}
+    ]
+
+
+def collect(result, metrics=None):
+    """Merge the $facet output of build_pipeline into ({day: {field: value}}, {hour: {field: value}})."""
+    metrics = metrics or list(METRICS.values())
+    periods = {DAY: {}, HOUR: {}}
+    for metric in metrics:
+        for period, values in metric.collect(result.get(metric.name, [])).items():
+            periods[metric.resolution].setdefault(period, {}).update(values)
+    return periods[DAY], periods[HOUR]
+
+
+def _activity(key):
+    # Grouping per (period, user) first counts distinct users on the server
+    return [
+        {"$group": {"_id": {"period": "$" + key, "user_id": "$user_id"}, "posts": {"$sum": 1}}},
+        {"$group": {"_id": "$_id.period", "post_count": {"$sum": "$posts"}, "active_users": {"$sum": 1}}}
+    ]
+
+
+def _collect_activity(rows):
+    return {row["_id"]: {"post_count": row["post_count"], "active_users": row["active_users"]} for row in rows}
+
+
+def _mix(field):
+    return [{"$group": {"_id": {"day": "$day", "value": {"$ifNull": ["$" + field, "unknown"]}}, "count": {"$sum": 1}}}]
+
+
+def _collect_mix(output):
+    def collect_rows(rows):
+        counts = {}
+        for row in rows:
+            # Field names must not contain dots
+            value = str(row["_id"]["value"]).replace(".", "_")
+            counts.setdefault(row["_id"]["day"], {})[value] = row["count"]
+        return {day: {output: {value: round(count / sum(values.values()), 4) for value, count in values.items()}}
+                for day, values in counts.items()}
+    return collect_rows
+
+
+register(Metric("daily_activity", ["user_id"], _activity("day"), _collect_activity))
+register(Metric("hourly_activity", ["user_id"], _activity("hour"), _collect_activity, resolution=HOUR))
+
+register(Metric(
+    "bot_share", ["user_bot"],
+    [{"$group": {"_id": "$day", "posts": {"$sum": 1}, "bot_posts": {"$sum": {"$cond": [{"$eq": ["$user_bot", True]}, 1, 0]}}}}],
+    lambda rows: {row["_id"]: {"bot_share": round(row["bot_posts"] / row["posts"], 4)} for row in rows}
+))
+
+register(Metric("language_mix", ["language"], _mix("language"), _collect_mix("language_mix")))
+register(Metric("visibility_mix", ["visibility"], _mix("visibility"), _collect_mix("visibility_mix")))
+
+
+def _collect_posts_by_hour(rows):
+    days = {}
+    for row in rows:
+        days.setdefault(row["_id"][:10], {})[row["_id"][11:13]] = row["posts"]
+    return {day: {"posts_by_hour": hours} for day, hours in days.items()}
+
+
+register(Metric(
+    "posts_by_hour", [],
+    [{"$group": {"_id": "$hour", "posts": {"$sum": 1}}}],
+    _collect_posts_by_hour
+))
@@ -1,21 +1,67 @@
 import schedule
 import time
-import subprocess
-from datetime import datetime
-
-def run_update():
-    print(f"[{datetime.now()}] Running update_analytics.py")
-    result = subprocess.run(
-        ["python", "/app/update_analytics.py"],
-        capture_output=True,
-        text=True
-    )
-    print(result.stdout)
-    print(result.stderr)
-
-run_update()
-
-schedule.every().day.at("02:00").do(run_update)
+import os
+import threading
+import traceback
+from datetime import datetime, timezone
+
+import update_analytics
+
+# Time of the nightly run of the finished days, and minutes between refreshes of the running day (0 disables them)
+daily_run_at = os.getenv('ANALYTICS_DAILY_AT', "02:00")
+refresh_minutes = int(os.getenv('ANALYTICS_REFRESH_MINUTES', 60))
+
+job_runs_collection = update_analytics.analytics_db['job_runs']
+
+
+class Job:
+    """An analytics job run on its own thread that never overlaps with itself.
+
+    Every run is recorded in the `job_runs` collection with its duration and the
+    totals the job returns (statuses scanned, days written, failed instances).
+    """
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+        self._running = threading.Lock()
+
+    def start(self):
+        # schedule runs jobs on its own loop; a thread keeps a long nightly run from delaying the refreshes
+        threading.Thread(target=self.run, name=self.name, daemon=True).start()
+
+    def run(self):
+        if not self._running.acquire(blocking=False):
+            print(f"[{datetime.now()}] {self.name} is still running, skipping this run")
+            return
+        started_at = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        run = {"job": self.name, "started_at": started_at}
+        try:
+            print(f"[{datetime.now()}] Running {self.name}")
+            run.update(self.function() or {})
+            run["status"] = "ok"
+        except Exception as e:
+            traceback.print_exc()
+            run.update({"status": "error", "error": str(e)})
+        finally:
+            self._running.release()
+        run.update({"finished_at": datetime.now(timezone.utc), "duration_s": round(time.perf_counter() - started, 3)})
+        print(f"[{datetime.now()}] {self.name} finished in {run['duration_s']}s: {run['status']}")
+        try:
+            job_runs_collection.insert_one(run)
+        except Exception as e:
+            print(f"Error recording the run of {self.name}:", e)
+
+
+daily_job = Job("update_analytics", update_analytics.main)
+refresh_job = Job("refresh_current_day", update_analytics.refresh_current_day)
+
+daily_job.run()
+
+schedule.every().day.at(daily_run_at).do(daily_job.start)
+if refresh_minutes > 0:
+    schedule.every(refresh_minutes).minutes.do(refresh_job.start)
 
 print("Scheduler started. Waiting for next run...")
 
@@ -1,9 +1,14 @@
-from pymongo import MongoClient
-import pandas as pd
+from pymongo import MongoClient, UpdateOne
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import pytz
 from dotenv import load_dotenv
+import argparse
 import os
+import time
+
+import correlations
+import metric_registry
 
 # dotenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
 # load_dotenv(dotenv_path)
@@ -12,112 +17,497 @@ mongo_uri = os.getenv('MONGO_URI')
 mongo_db_name_A = os.getenv('MONGO_DB_A')
 mongo_db_name_B = os.getenv('MONGO_DB_B')
 
-client = MongoClient(mongo_uri)
+# Number of instances whose analytics are computed at the same time
+analytics_workers = int(os.getenv('ANALYTICS_WORKERS', 4))
+
+# One client for all workers; its pool is sized so every worker gets a connection
+client = MongoClient(mongo_uri, maxPoolSize=max(100, analytics_workers * 2))
 
 # Databases
 raw_db = client[mongo_db_name_B]        # Raw data
 analytics_db = client[mongo_db_name_A]  # Precomputed analytics
 
-# Collection names
-collection_names = raw_db.list_collection_names()
 postsperday_collection = analytics_db['postsperday']
 dailyactiveusers_collection = analytics_db['dailyactiveusers']
 averageuseractivity_collection = analytics_db['averageuseractivity']
+livestats_collection = analytics_db['livestats']  # Live counters and user sketches kept by the streamer
+checkpoints_collection = analytics_db['checkpoints']  # Last fully processed day per (instance, metric)
+dailymetrics_collection = analytics_db['dailymetrics']  # All daily metrics of an instance in one row per (date, instance)
+rollups_collection = analytics_db['rollups']  # Hourly, weekly and monthly metrics per (resolution, period, instance)
+correlations_collection = analytics_db['correlations']  # Spearman matrices per (metric, window, sma) for the dashboard
+
+# Rollup resolutions next to the daily one in dailymetrics
+HOUR = "hour"
+WEEK = "week"
+MONTH = "month"
+
+# The metric collections and the field each of them holds
+METRIC_COLLECTIONS = {
+    "postsperday": (postsperday_collection, "post_count"),
+    "dailyactiveusers": (dailyactiveusers_collection, "active_users"),
+    "averageuseractivity": (averageuseractivity_collection, "avg_posts_per_user"),
+}
+
+# Keep writing the one-metric collections above next to dailymetrics, for readers that still use them
+legacy_output = os.getenv('ANALYTICS_LEGACY_OUTPUT', 'true').lower() in ('1', 'true', 'yes')
 
 # Define timezones
 utc = pytz.utc
 cet = pytz.timezone("Europe/Berlin")
 
-current_utc_date = datetime.now(utc).date()
-start_limit = datetime.combine(current_utc_date - timedelta(days=14), datetime.min.time()).isoformat()
-end_limit = datetime.combine(current_utc_date, datetime.min.time()).isoformat()
-
-# Get all unique dates present in `mastodon_db`
-existing_dates = set()
-for collection_name in collection_names:
-    collection = raw_db[collection_name]
-    cursor = collection.find(
-        {"created_at": {"$gte": start_limit, "$lt": end_limit}},
-        {"_id": 0, "created_at": 1}
-    ).batch_size(1000)
-    for doc in cursor:
-        try:
-            if "created_at" in doc:
-                date = pd.to_datetime(doc["created_at"], errors='coerce')
-                if pd.notna(date):
-                    date_str = date.strftime("%Y-%m-%d")
-                    existing_dates.add(date_str)
-        except Exception as e:
-            print(f"Error parsing date in collection {collection_name}:", e)
+# Trailing windows (days up to the last finished one) whose correlation matrices are precomputed for the dashboard
+correlation_windows = [int(days) for days in os.getenv('ANALYTICS_CORRELATION_WINDOWS', '7,30,90').split(',') if days.strip()]
+
+# Instances without a checkpoint start this many days back
+lookback_days = int(os.getenv('ANALYTICS_LOOKBACK_DAYS', 14))
+
+# Set by refresh_run_state() at the start of every run, so a long-lived scheduler sees new instances and dates
+collection_names = []
+collection_fields = {}
+start_limit = None
+end_limit = None
+
+
+# Field names of the two raw layouts the streamer writes (see raw_schema.py in the streamer).
+# Compact collections are time-series collections with short keys and always store datetimes.
+LEGACY_FIELDS = {"id": "id", "created_at": "created_at", "user_id": "user_id",
+                 "user_bot": "user_bot", "visibility": "visibility", "language": "language"}
+COMPACT_FIELDS = {"id": "i", "created_at": "t", "user_id": "u",
+                  "user_bot": "b", "visibility": "v", "language": "l"}
+
+
+def raw_fields(collection_name):
+    for info in raw_db.list_collections(filter={"name": collection_name}):
+        timeseries = info.get("options", {}).get("timeseries")
+        if timeseries and timeseries.get("timeField") == COMPACT_FIELDS["created_at"]:
+            return COMPACT_FIELDS
+    return LEGACY_FIELDS
+
+
+def refresh_run_state():
+    global collection_names, collection_fields, start_limit, end_limit
+    # Collection names (time-series collections come with internal system.buckets.* collections)
+    collection_names = raw_db.list_collection_names(filter={"name": {"$not": {"$regex": "^system\\."}}})
+    collection_fields = {collection_name: raw_fields(collection_name) for collection_name in collection_names}
+
+    current_utc_date = datetime.now(utc).date()
+    start_limit = datetime.combine(current_utc_date - timedelta(days=lookback_days), datetime.min.time(), tzinfo=utc)
+    end_limit = datetime.combine(current_utc_date, datetime.min.time(), tzinfo=utc)
+
+
+def created_at_range(start_time, end_time, fields=LEGACY_FIELDS):
+    if fields is COMPACT_FIELDS:
+        return {fields["created_at"]: {"$gte": start_time, "$lt": end_time}}
+    # The streamer stores created_at as a BSON datetime; documents written before
+    # that change (and not yet migrated) still hold ISO strings, which only match string bounds
+    return {"$or": [
+        {"created_at": {"$gte": start_time, "$lt": end_time}},
+        {"created_at": {"$gte": start_time.isoformat(), "$lt": end_time.isoformat()}}
+    ]}
+
+
+def days_with_data(collection_name, start_date, end_date):
+    """Return the UTC days in [start_date, end_date) on which collection_name has at least one status.
+
+    Runs as one aggregation per collection: a $limit 1 probe per day, chained with
+    $unionWith. Each probe is a single seek on the created_at index, so the cost
+    depends on the number of days, not on the number of statuses.
+    """
+    fields = collection_fields[collection_name]
+    probes = []
+    day = start_date
+    while day < end_date:
+        start_time = datetime.combine(day, datetime.min.time(), tzinfo=utc)
+        probes.append([
+            {"$match": created_at_range(start_time, start_time + timedelta(days=1), fields)},
+            {"$limit": 1},
+            {"$project": {"_id": 0, "day": {"$literal": day.strftime("%Y-%m-%d")}}}
+        ])
+        day += timedelta(days=1)
+    if not probes:
+        return set()
+
+    pipeline = probes[0] + [{"$unionWith": {"coll": collection_name, "pipeline": probe}} for probe in probes[1:]]
+    return {doc["day"] for doc in raw_db[collection_name].aggregate(pipeline)}
+
+
+def rollup_days(collection_name, days):
+    """Return ({day: {field: value}}, {hour: {field: value}}) for the given days.
+
+    All metrics of metric_registry are computed in one aggregation, so the raw
+    statuses of the days are scanned once however many metrics are registered.
+    Every day and hour with statuses has at least post_count and active_users.
+    """
+    fields = collection_fields[collection_name]
+    day_ranges = []
+    for day in days:
+        start_time = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=utc)
+        day_ranges.append(created_at_range(start_time, start_time + timedelta(days=1), fields))
+
+    pipeline = metric_registry.build_pipeline({"$or": day_ranges}, fields)
+    return metric_registry.collect(next(raw_db[collection_name].aggregate(pipeline, allowDiskUse=True), {}))
+
+
+def derive_rollups(collection_name, days):
+    """Recompute the weekly and monthly rollups that contain the given days from dailymetrics.
+
+    Weeks start on Monday and periods are keyed by their first day. Their metrics
+    are means per day over the days with data, and `days` says how many that were;
+    post_total is the sum of posts over the period.
+    """
+    first_day = datetime.strptime(days[0], "%Y-%m-%d").date()
+    last_day = datetime.strptime(days[-1], "%Y-%m-%d").date()
+    month_end = (last_day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    for resolution, start, end, unit in [
+        (WEEK, first_day - timedelta(days=first_day.weekday()), last_day + timedelta(days=6 - last_day.weekday()), "week"),
+        (MONTH, first_day.replace(day=1), month_end, "month"),
+    ]:
+        dailymetrics_collection.aggregate([
+            {"$match": {"instance": collection_name,
+                        "date": {"$gte": start.strftime("%Y-%m-%d"), "$lte": end.strftime("%Y-%m-%d")}}},
+            {"$group": {
+                "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$dateTrunc": {
+                    "date": {"$dateFromString": {"dateString": "$date"}}, "unit": unit, "startOfWeek": "monday"
+                }}}},
+                "post_count": {"$avg": "$post_count"},
+                "active_users": {"$avg": "$active_users"},
+                "avg_posts_per_user": {"$avg": "$avg_posts_per_user"},
+                "post_total": {"$sum": "$post_count"},
+                "days": {"$sum": 1},
+                "estimated": {"$max": "$estimated"}
+            }},
+            {"$project": {
+                "_id": 0, "resolution": {"$literal": resolution}, "instance": {"$literal": collection_name}, "period": "$_id",
+                "post_count": {"$round": ["$post_count", 2]},
+                "active_users": {"$round": ["$active_users", 2]},
+                "avg_posts_per_user": {"$round": ["$avg_posts_per_user", 2]},
+                "post_total": 1, "days": 1,
+                "estimated": {"$ifNull": ["$estimated", False]}
+            }},
+            {"$merge": {"into": rollups_collection.name, "on": ["resolution", "period", "instance"],
+                        "whenMatched": "replace", "whenNotMatched": "insert"}}
+        ])
+
+
+def reconcile_live_stats(collection_name, rollup):
+    """Store the exact values next to the streamer's live day counters and report how far they were off."""
+    now = datetime.now(utc)
+    for live in livestats_collection.find({"instance": collection_name, "resolution": "day",
+                                           "period": {"$in": list(rollup)}}):
+        post_count, unique_users = rollup[live["period"]]["post_count"], rollup[live["period"]]["active_users"]
+        if unique_users:
+            error = (live.get("active_users", 0) - unique_users) / unique_users
+            print(f"{collection_name} {live['period']}: live active users {live.get('active_users', 0)}, "
+                  f"exact {unique_users} ({error:+.2%}); live posts {live.get('post_count', 0)}, exact {post_count}")
+        livestats_collection.update_one({"_id": live["_id"]}, {"$set": {
+            "exact_post_count": post_count,
+            "exact_active_users": unique_users,
+            "reconciled_at": now
+        }})
+
+
+def remove_duplicate_rows(collection):
+    """Keep one row per (date, instance), preferring exact rows over live estimates."""
+    pipeline = [
+        {"$sort": {"estimated": 1}},  # A missing flag sorts before true, so exact rows come first
+        {"$group": {"_id": {"date": "$date", "instance": "$instance"}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    removed = 0
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        removed += collection.delete_many({"_id": {"$in": group["ids"][1:]}}).deleted_count
+    return removed
+
+
+def seed_daily_metrics():
+    """Fill an empty dailymetrics collection from the one-metric collections, in one server-side pipeline."""
+    metric_fields = [field for _, field in METRIC_COLLECTIONS.values()]
+    collections = list(METRIC_COLLECTIONS)
+    project = {"_id": 0, "date": 1, "instance": 1, "estimated": 1}
+    pipeline = [{"$project": {**project, metric_fields[0]: 1}}]
+    for name, field in zip(collections[1:], metric_fields[1:]):
+        pipeline.append({"$unionWith": {"coll": name, "pipeline": [{"$project": {**project, field: 1}}]}})
+    pipeline += [
+        {"$group": {"_id": {"date": "$date", "instance": "$instance"},
+                    "estimated": {"$max": "$estimated"},
+                    **{field: {"$max": "$" + field} for field in metric_fields}}},
+        {"$project": {"_id": 0, "date": "$_id.date", "instance": "$_id.instance",
+                      "estimated": {"$ifNull": ["$estimated", "$$REMOVE"]},
+                      **{field: {"$ifNull": ["$" + field, 0]} for field in metric_fields}}},
+        {"$merge": {"into": dailymetrics_collection.name, "on": ["date", "instance"],
+                    "whenMatched": "keep", "whenNotMatched": "insert"}}
+    ]
+    analytics_db[collections[0]].aggregate(pipeline, allowDiskUse=True)
+
+
+def ensure_analytics_indexes():
+    for metric, (collection, _) in METRIC_COLLECTIONS.items():
+        if "date_instance" not in collection.index_information():
+            # Rows inserted before the unique key existed may be duplicated
+            removed = remove_duplicate_rows(collection)
+            if removed:
+                print(f"Removed {removed} duplicate rows from {metric}.")
+            collection.create_index([("date", 1), ("instance", 1)], unique=True, name="date_instance")
+    if "date_instance" not in dailymetrics_collection.index_information():
+        dailymetrics_collection.create_index([("date", 1), ("instance", 1)], unique=True, name="date_instance")
+        seed_daily_metrics()
+    if "resolution_period_instance" not in rollups_collection.index_information():
+        rollups_collection.create_index([("resolution", 1), ("period", 1), ("instance", 1)], unique=True,
+                                        name="resolution_period_instance")
+        # Weeks and months of the days stored so far; hours only exist for days computed from now on
+        for instance in dailymetrics_collection.distinct("instance"):
+            dates = [doc["date"] for direction in (1, -1)
+                     for doc in dailymetrics_collection.find({"instance": instance}, {"date": 1}).sort("date", direction).limit(1)]
+            derive_rollups(instance, dates)
+    checkpoints_collection.create_index([("instance", 1), ("metric", 1)], unique=True, name="instance_metric")
+    correlations_collection.create_index([("metric", 1), ("window", 1), ("sma", 1)], unique=True, name="metric_window_sma")
+
 
-# Get all unique dates already in `analytics_db`
-analytics_dates_posts = set(postsperday_collection.distinct("date"))
-analytics_dates_users = set(dailyactiveusers_collection.distinct("date"))
-analytics_dates_avg = set(averageuseractivity_collection.distinct("date"))
+def update_correlations():
+    """Store the Spearman matrix of every daily metric over each standard window, with and without the 7-day SMA.
 
-# Find missing dates for all three tables (only for finished days)
-missing_dates_posts = sorted(existing_dates - analytics_dates_posts)
-missing_dates_users = sorted(existing_dates - analytics_dates_users)
-missing_dates_avg = sorted(existing_dates - analytics_dates_avg)
+    Windows end on the last finished day. The dashboard serves a stored matrix when
+    its range is exactly [start_date, end_date]; returns the number of matrices stored.
+    """
+    if not correlation_windows:
+        return 0
+    last_day = end_limit.date() - timedelta(days=1)
+    end_date = last_day.strftime("%Y-%m-%d")
+    metric_fields = [field for _, field in METRIC_COLLECTIONS.values()]
+    first_date = (last_day - timedelta(days=max(correlation_windows) - 1)).strftime("%Y-%m-%d")
+    rows = list(dailymetrics_collection.find(
+        {"date": {"$gte": first_date, "$lte": end_date}},
+        {"_id": 0, "date": 1, "instance": 1, **{field: 1 for field in metric_fields}}
+    ))
 
-# Prepare data for insertion
-postsperday_data = []
-dailyactiveusers_data = []
-averageuseractivity_data = []
+    now = datetime.now(utc)
+    operations = []
+    for window in correlation_windows:
+        start_date = (last_day - timedelta(days=window - 1)).strftime("%Y-%m-%d")
+        window_rows = [row for row in rows if row["date"] >= start_date]
+        if not window_rows:
+            continue
+        for field in metric_fields:
+            _, instances, values = correlations.pivot(window_rows, field)
+            for sma in (False, True):
+                matrix = correlations.spearman(correlations.moving_average(values) if sma else values)
+                operations.append(UpdateOne({"metric": field, "window": window, "sma": sma}, {"$set": {
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "instances": instances,
+                    "matrix": matrix.tolist(),
+                    "computed_at": now
+                }}, upsert=True))
+    if operations:
+        correlations_collection.bulk_write(operations, ordered=False)
+    return len(operations)
 
-for missing_date in sorted(set(missing_dates_posts + missing_dates_users + missing_dates_avg)):
-    start_time = datetime.strptime(missing_date, "%Y-%m-%d").replace(tzinfo=utc)
-    end_time = start_time + timedelta(days=1)
 
-    for collection_name in collection_names:
-        collection = raw_db[collection_name]
+def resume_date(collection_name):
+    """Return the first day collection_name still has to be processed from, or None without a checkpoint."""
+    watermarks = {doc["metric"]: doc["watermark"] for doc in checkpoints_collection.find({"instance": collection_name})}
+    if set(watermarks) != set(METRIC_COLLECTIONS):
+        return None
+    return datetime.strptime(min(watermarks.values()), "%Y-%m-%d").date() + timedelta(days=1)
 
-        # Count number of posts
-        post_count = collection.count_documents({
-            "created_at": {"$gte": start_time.isoformat(), "$lt": end_time.isoformat()}
-        })
 
-        # Count unique users
-        unique_users = len(collection.distinct("user_id", {
-            "created_at": {"$gte": start_time.isoformat(), "$lt": end_time.isoformat()}
-        }))
+def advance_watermark(collection_name, last_day):
+    # Never past the last finished day, or the running day would be skipped once it is over
+    last_day = min(last_day, (end_limit.date() - timedelta(days=1)).strftime("%Y-%m-%d"))
+    now = datetime.now(utc)
+    for metric in METRIC_COLLECTIONS:
+        checkpoints_collection.update_one(
+            {"instance": collection_name, "metric": metric},
+            {"$max": {"watermark": last_day}, "$set": {"updated_at": now}},
+            upsert=True
+        )
+
+
+def update_instance(collection_name, existing_dates, start_date=None, end_date=None, partial=False):
+    """Compute and upsert the days of one instance; returns (days written, statuses scanned).
+
+    Without a range the instance resumes from its checkpoint, or from the lookback
+    window without one, up to yesterday. Rows are upserted on (date, instance), so
+    rerunning a range after a crash rewrites it instead of duplicating it, and the
+    checkpoint only moves once all rows of the range are stored. Every instance is
+    read and written on its own, so it can run on any worker thread and its rows
+    are stored no matter how the other instances fare.
+
+    A partial run refreshes a day that isn't over yet: its rows stay marked as
+    estimated and neither the live stats nor the checkpoint are touched.
+    """
+    resume = resume_date(collection_name)
+    if start_date is None:
+        start_date = resume or start_limit.date()
+    if end_date is None:
+        end_date = end_limit.date()
+    days = sorted(day for day in existing_dates if start_date.strftime("%Y-%m-%d") <= day < end_date.strftime("%Y-%m-%d"))
+
+    rollup, hourly = rollup_days(collection_name, days) if days else ({}, {})
+    if not partial:
+        try:
+            reconcile_live_stats(collection_name, rollup)
+        except Exception as e:
+            print(f"Error reconciling live stats of {collection_name}:", e)
+
+    def upsert(day, values):
+        # Overwrites the streamer's live estimate of the day, if there is one
+        update = {"$set": {**values, "estimated": True}} if partial else {"$set": values, "$unset": {"estimated": ""}}
+        return UpdateOne({"date": day, "instance": collection_name}, update, upsert=True)
+
+    rows = []
+    legacy_requests = {metric: [] for metric in METRIC_COLLECTIONS}
+    for day in days:
+        values = rollup.get(day, {})
+        post_count, unique_users = values.get("post_count", 0), values.get("active_users", 0)
 
         # Calculate average user activity (posts per active user)
         avg_activity = round(post_count / unique_users, 2) if unique_users > 0 else 0
 
-        if missing_date in missing_dates_posts:
-            postsperday_data.append({
-                "date": missing_date,
-                "instance": collection_name,
-                "post_count": post_count
-            })
-
-        if missing_date in missing_dates_users:
-            dailyactiveusers_data.append({
-                "date": missing_date,
-                "instance": collection_name,
-                "active_users": unique_users
-            })
-
-        if missing_date in missing_dates_avg:
-            averageuseractivity_data.append({
-                "date": missing_date,
-                "instance": collection_name,
-                "avg_posts_per_user": avg_activity
-            })
-
-# Insert missing records into `analytics_db`
-if postsperday_data:
-    postsperday_collection.insert_many(postsperday_data)
-    print(f"Added {len(missing_dates_posts)} missing days to postsperday.")
-
-if dailyactiveusers_data:
-    dailyactiveusers_collection.insert_many(dailyactiveusers_data)
-    print(f"Added {len(missing_dates_users)} missing days to dailyactiveusers.")
-
-if averageuseractivity_data:
-    averageuseractivity_collection.insert_many(averageuseractivity_data)
-    print(f"Added {len(missing_dates_avg)} missing days to averageuseractivity.")
-
-if not postsperday_data and not dailyactiveusers_data and not averageuseractivity_data:
-    print("No missing days detected. Analytics up to date.")
+        rows.append(upsert(day, {**values, "post_count": post_count, "active_users": unique_users,
+                                 "avg_posts_per_user": avg_activity}))
+        if legacy_output:
+            for metric, value in [("postsperday", post_count),
+                                  ("dailyactiveusers", unique_users),
+                                  ("averageuseractivity", avg_activity)]:
+                legacy_requests[metric].append(upsert(day, {METRIC_COLLECTIONS[metric][1]: value}))
+
+    hour_rows = []
+    for hour, values in hourly.items():
+        post_count, unique_users = values.get("post_count", 0), values.get("active_users", 0)
+        values = {**values, "post_count": post_count, "active_users": unique_users,
+                  "avg_posts_per_user": round(post_count / unique_users, 2) if unique_users > 0 else 0,
+                  "estimated": partial}
+        hour_rows.append(UpdateOne({"resolution": HOUR, "period": hour, "instance": collection_name},
+                                   {"$set": values}, upsert=True))
+
+    if rows:
+        dailymetrics_collection.bulk_write(rows, ordered=False)
+    if hour_rows:
+        rollups_collection.bulk_write(hour_rows, ordered=False)
+    for metric, metric_requests in legacy_requests.items():
+        if metric_requests:
+            METRIC_COLLECTIONS[metric][0].bulk_write(metric_requests, ordered=False)
+    if days:
+        # Weeks and months are derived from the stored days, never from the raw statuses
+        derive_rollups(collection_name, days)
+
+    # A backfill that leaves a gap after the checkpoint must not move it past the gap
+    if not partial and (resume is None or start_date <= resume):
+        advance_watermark(collection_name, (end_date - timedelta(days=1)).strftime("%Y-%m-%d"))
+    return len(days), sum(values.get("post_count", 0) for values in rollup.values())
+
+
+def run_per_instance(function, instances, *args):
+    """Run function(collection_name, *args) for every instance on the worker pool.
+
+    Returns {collection_name: (result or None, error or None, seconds)}.
+    """
+    def timed(collection_name):
+        started = time.perf_counter()
+        try:
+            return function(collection_name, *args), None, time.perf_counter() - started
+        except Exception as e:
+            return None, e, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=analytics_workers, thread_name_prefix="analytics") as pool:
+        futures = {pool.submit(timed, collection_name): collection_name for collection_name in instances}
+        return {futures[future]: future.result() for future in as_completed(futures)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compute the daily analytics of every instance.")
+    parser.add_argument("--from", dest="start", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                        help="backfill from this UTC day (YYYY-MM-DD) regardless of the checkpoints")
+    parser.add_argument("--to", dest="end", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                        help="last UTC day of the backfill (default and latest: yesterday)")
+    parser.add_argument("--instance", action="append", help="only process this instance (repeatable)")
+    return parser.parse_args()
+
+
+def process(instances, existing_dates, probe_results, start, end_date, partial=False):
+    """Update the instances on the worker pool, print the timing summary and return the run totals."""
+    # An instance whose days couldn't be probed is not updated: existing_dates only holds the other instances'
+    # days, and its checkpoint would move past days it may have data on. It counts as failed and is retried next run.
+    probed = [collection_name for collection_name in instances if probe_results[collection_name][1] is None]
+    update_results = run_per_instance(update_instance, probed, existing_dates, start, end_date, partial)
+    for collection_name in instances:
+        if collection_name not in update_results:
+            update_results[collection_name] = (None, f"day probe failed: {probe_results[collection_name][1]}", 0.0)
+
+    print(f"{'instance':<40} {'days':>5} {'docs':>9} {'probe s':>8} {'update s':>9}  status")
+    for collection_name in sorted(update_results):
+        result, error, seconds = update_results[collection_name]
+        days, scanned = result or (0, 0)
+        probe_seconds = probe_results[collection_name][2]
+        status = f"error: {error}" if error is not None else "ok"
+        print(f"{collection_name:<40} {days:>5} {scanned:>9} {probe_seconds:>8.2f} {seconds:>9.2f}  {status}")
+
+    results = [result for result, _, _ in update_results.values() if result is not None]
+    return {
+        "days_written": sum(days for days, _ in results),
+        # Each day probe that found data read one status
+        "docs_scanned": sum(scanned for _, scanned in results) + sum(len(dates or ()) for dates, _, _ in probe_results.values()),
+        "failed_instances": sum(1 for _, error, _ in update_results.values() if error is not None),
+    }
+
+
+def probe_days(instances, start_date, end_date):
+    """Return (days any of the instances has statuses on, per-instance probe results)."""
+    existing_dates = set()
+    probe_results = run_per_instance(days_with_data, instances, start_date, end_date)
+    for collection_name, (dates, error, _) in probe_results.items():
+        if error is not None:
+            print(f"Error finding dates in collection {collection_name}:", error)
+        else:
+            existing_dates |= dates
+    return existing_dates, probe_results
+
+
+def main(start=None, end=None, instances=None):
+    """Bring the finished days of every instance up to date; returns the run totals."""
+    started = time.perf_counter()
+    refresh_run_state()
+    instances = instances or collection_names
+    # Only finished days: the running day is refreshed as an estimate by refresh_current_day
+    end_date = min(end + timedelta(days=1), end_limit.date()) if end else end_limit.date()
+    if end and end_date <= end:
+        print(f"--to {end} is not a finished day yet; stopping at {end_date - timedelta(days=1)}.")
+
+    ensure_analytics_indexes()
+
+    # Probe from the earliest day any instance still needs (only finished days)
+    probe_start = start or min((resume_date(collection_name) or start_limit.date() for collection_name in instances),
+                               default=start_limit.date())
+
+    # Get all unique dates present in `mastodon_db`
+    existing_dates, probe_results = probe_days(instances, probe_start, end_date)
+    totals = process(instances, existing_dates, probe_results, start, end_date)
+    totals["correlation_matrices"] = update_correlations()
+
+    if totals["days_written"]:
+        print(f"Wrote {totals['days_written']} instance days in {time.perf_counter() - started:.2f}s "
+              f"with {analytics_workers} workers ({totals['failed_instances']} instances failed).")
+    elif not totals["failed_instances"]:
+        print("No missing days detected. Analytics up to date.")
+    else:
+        print(f"No days written; {totals['failed_instances']} instances failed.")
+    return totals
+
+
+def refresh_current_day(instances=None):
+    """Recompute the running UTC day of every instance from the raw statuses; returns the run totals.
+
+    The rows stay marked as estimated until the nightly run computes the finished day.
+    """
+    refresh_run_state()
+    instances = instances or collection_names
+    today = end_limit.date()
+    ensure_analytics_indexes()
+    existing_dates, probe_results = probe_days(instances, today, today + timedelta(days=1))
+    return process(instances, existing_dates, probe_results, today, today + timedelta(days=1), partial=True)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args.start, args.end, args.instance)
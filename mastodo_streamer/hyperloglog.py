@@ -0,0 +1,42 @@
+import hashlib
+import math
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter (Flajolet et al., 2007) with 2**precision one-byte registers.
+
+    The relative standard error of count() is about 1.04 / sqrt(2**precision):
+    1.6% for the default precision of 12, which takes 4 KiB per sketch. Small
+    cardinalities fall back to linear counting and are close to exact. Sketches
+    of the same precision merge losslessly by taking the register-wise maximum,
+    so hourly sketches combine into a daily one and a sketch can be persisted,
+    reloaded after a restart and kept updating.
+    """
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError(f"expected {self.size} registers for precision {precision}, got {len(self.registers)}")
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("can only merge sketches of the same precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson.binary import Binary
+from pymongo import UpdateOne
+
+from hyperloglog import HyperLogLog
+from structured_log import log_event
+
+DAY = "day"
+HOUR = "hour"
+PERIOD_FORMATS = {DAY: "%Y-%m-%d", HOUR: "%Y-%m-%dT%H"}
+
+
+class LiveStats:
+    """Per-(instance, day) and per-(instance, hour) counters kept up to date by the writer.
+
+    Every status the writer stores for the first time bumps the post count of its
+    UTC day and hour, and its user id goes into a HyperLogLog sketch of that
+    period. Counters and sketches are saved to the `livestats` collection of the
+    analytics database at most every `publish_interval` seconds. The current day
+    is also published to dailymetrics (and, with `legacy_output`, to postsperday,
+    dailyactiveusers and averageuseractivity) with `estimated: True`. Post counts are exact. Active users carry the
+    sketch's error, about 1.6% relative standard error at the default precision
+    of 12. The nightly job replaces the estimated rows with exact ones and records
+    how far the sketch was off.
+    """
+
+    def __init__(self, analytics_db, instance, precision=12, publish_interval=5.0, legacy_output=True):
+        self.analytics_db = analytics_db
+        self.collection = analytics_db['livestats']
+        self.instance = instance
+        self.precision = precision
+        self.publish_interval = publish_interval
+        self.legacy_output = legacy_output
+
+        self._lock = threading.Lock()
+        self._sketches = {}  # (resolution, period) -> HyperLogLog
+        self._totals = {}    # (resolution, period) -> post count including earlier runs
+        self._pending = {}   # (resolution, period) -> posts not yet saved
+        self._last_publish = time.monotonic()
+
+    def record(self, statuses):
+        """Count newly stored statuses, given as (created_at, user_id) pairs."""
+        with self._lock:
+            for created_at, user_id in statuses:
+                if created_at.tzinfo is None:
+                    created_at = created_at.replace(tzinfo=timezone.utc)  # BSON datetimes decode as naive UTC
+                created_at = created_at.astimezone(timezone.utc)
+                for resolution, period_format in PERIOD_FORMATS.items():
+                    key = (resolution, created_at.strftime(period_format))
+                    self._sketch(key).add(user_id)
+                    self._totals[key] += 1
+                    self._pending[key] = self._pending.get(key, 0) + 1
+
+    def publish_if_due(self):
+        if time.monotonic() - self._last_publish < self.publish_interval:
+            return
+        self._last_publish = time.monotonic()
+        try:
+            self.publish()
+        except Exception as e:
+            log_event("live_stats_error", logging.WARNING, instance=self.instance, error=str(e))
+
+    def publish(self):
+        now = datetime.now(timezone.utc)
+        today = now.strftime(PERIOD_FORMATS[DAY])
+        with self._lock:
+            self._forget_old_periods(today)
+            pending, self._pending = self._pending, {}
+            updates = [(key, count, bytes(self._sketches[key].registers), self._sketches[key].count(), self._totals[key])
+                       for key, count in pending.items()]
+        if not updates:
+            return
+
+        try:
+            self.collection.bulk_write([
+                UpdateOne(
+                    {"instance": self.instance, "resolution": resolution, "period": period},
+                    {"$inc": {"post_count": count},
+                     "$set": {"hll": Binary(registers), "precision": self.precision, "active_users": active_users, "updated_at": now}},
+                    upsert=True
+                ) for (resolution, period), count, registers, active_users, _ in updates
+            ], ordered=False)
+        except Exception:
+            # Keep the counts for the next attempt; the sketches are still in memory
+            with self._lock:
+                for key, count in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + count
+            raise
+
+        # Only the running day goes to the dashboard collections; finished days belong to the nightly job
+        for (resolution, period), _, _, active_users, post_count in updates:
+            if resolution == DAY and period == today:
+                self._publish_day(period, post_count, active_users)
+
+    def _publish_day(self, day, post_count, active_users):
+        avg_activity = round(post_count / active_users, 2) if active_users > 0 else 0
+        key = {"date": day, "instance": self.instance}
+        self.analytics_db['dailymetrics'].update_one(key, {"$set": {
+            "post_count": post_count, "active_users": active_users, "avg_posts_per_user": avg_activity, "estimated": True
+        }}, upsert=True)
+        if not self.legacy_output:
+            return
+        for collection_name, field, value in [
+            ("postsperday", "post_count", post_count),
+            ("dailyactiveusers", "active_users", active_users),
+            ("averageuseractivity", "avg_posts_per_user", avg_activity),
+        ]:
+            self.analytics_db[collection_name].update_one(
+                key, {"$set": {field: value, "estimated": True}}, upsert=True
+            )
+
+    def _sketch(self, key):
+        # Continue the persisted sketch after a restart instead of starting from zero
+        if key not in self._sketches:
+            resolution, period = key
+            saved = self.collection.find_one({"instance": self.instance, "resolution": resolution, "period": period},
+                                             {"hll": 1, "precision": 1, "post_count": 1})
+            registers = None
+            if saved and saved.get("precision") == self.precision:
+                registers = saved["hll"]
+            self._sketches[key] = HyperLogLog(self.precision, registers)
+            self._totals[key] = saved.get("post_count", 0) if saved else 0
+        return self._sketches[key]
+
+    def _forget_old_periods(self, today):
+        # Keep today's and yesterday's periods in memory; late statuses for older ones reload from MongoDB
+        keep_from = (datetime.strptime(today, PERIOD_FORMATS[DAY]) - timedelta(days=1)).strftime(PERIOD_FORMATS[DAY])
+        for key in list(self._sketches):
+            if key[1][:10] < keep_from and key not in self._pending:
+                del self._sketches[key]
+                del self._totals[key]
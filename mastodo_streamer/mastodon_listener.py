@@ -1,52 +1,168 @@
 from mastodon import Mastodon, StreamListener
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 from dotenv import load_dotenv
+from datetime import datetime
 import os
+import logging
+import threading
+import time
 from config import Config
+from live_stats import LiveStats
+from metrics import registry
+from raw_schema import prepare_collection
+from spill import SpillLog, spill_directory
+from status_writer import StatusWriter
+from stream_recovery import Backoff, Backfiller
+from structured_log import log_event, RateLimitedLog
 import json
 
 
+_mongo_client = None
+_mongo_client_lock = threading.Lock()
+
+
+def get_database():
+    # One MongoClient (and connection pool) shared by every stream in the process
+    global _mongo_client
+    with _mongo_client_lock:
+        if _mongo_client is None:
+            _mongo_client = MongoClient(os.getenv('MONGO_URI'))    #USE FOR DOCKER
+    return _mongo_client[os.getenv('MONGO_DB_B')]
+
+
+def get_analytics_database():
+    # The precomputed analytics database the dashboard reads; shares the raw database's client
+    get_database()
+    return _mongo_client[os.getenv('MONGO_DB_A')]
+
+
+def parse_datetime(value):
+    # Mastodon.py already parses dates, raw streaming JSON carries ISO strings like 2024-10-24T12:00:00.000Z
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value
+
+
+def build_status_document(status):
+    # Works for Mastodon.py's AttribAccessDict as well as plain dicts decoded from the streaming API
+    return {
+        'id': int(status['id']),
+        'created_at': parse_datetime(status['created_at']),
+        'username': None,
+        'user_id': int(status['account']['id']),
+        'user_bot': status['account']['bot'],
+        'visibility': status['visibility'],
+        'language': status['language']
+    }
+
+
 class MastodonListener(StreamListener):
-    def __init__(self, collection_name):
+    def __init__(self, collection_name, shared_writer=None):
 
         #dotenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
         #load_dotenv(dotenv_path)
 
-        mongo_uri = os.getenv('MONGO_URI')
-        mongo_db_name = os.getenv('MONGO_DB_B')
-
-        client = MongoClient(mongo_uri)    #USE FOR DOCKER
-        db = client[mongo_db_name]
+        db = get_database()
         self.collection = db[collection_name]  # Each instance has its own collection
+        layout = None
+        while layout is None:
+            # The layout decides what gets queued and spilled, so it has to be known before streaming starts
+            try:
+                layout = prepare_collection(db, collection_name, Config.get_storage_config()['compact'])
+            except PyMongoError as e:
+                log_event("mongo_unavailable", logging.WARNING, collection=collection_name, error=str(e))
+                time.sleep(5)
+        self.metrics = registry.get(collection_name)
+        spill_config = Config.get_spill_config()
+        spill = None
+        if spill_config['enabled']:
+            spill = SpillLog(spill_directory(spill_config['directory'], collection_name),
+                             spill_config['max_bytes'], spill_config['segment_bytes'])
+        live_stats_config = Config.get_live_stats_config()
+        live_stats = None
+        if live_stats_config['enabled'] and os.getenv('MONGO_DB_A'):
+            live_stats = LiveStats(get_analytics_database(), collection_name,
+                                   precision=live_stats_config['precision'],
+                                   publish_interval=live_stats_config['publish_interval'],
+                                   legacy_output=live_stats_config['legacy_output'])
+        self.writer = StatusWriter(self.collection, metrics=self.metrics, spill=spill, live_stats=live_stats,
+                                   replay_batch_size=spill_config['replay_batch_size'],
+                                   replay_interval=spill_config['replay_interval'],
+                                   layout=layout, shared=shared_writer,
+                                   **Config.get_writer_config())
+        self.status_log = RateLimitedLog("statuses_received", Config.get_logging_config()['status_log_interval'])
 
+        self.last_status_id = None  # Newest status id stored, the starting point for backfill after a reconnect
+        self.resume_id = None       # First status id delivered by the current connection
+        self.alive = False          # Whether the current connection delivered a heartbeat or status yet
+        self._on_alive = None
 
-    def on_update(self, status):
-        status_data = {
-            'id': status.id,
-            'created_at': status.created_at.isoformat(),
-            'username': None,
-            'user_id': status.account.id,
-            'user_bot': status.account.bot,
-            'visibility': status.visibility,
-            'language': status.language
-        }
 
-        # Insert the status data into MongoDB
-        self.collection.insert_one(status_data)
+    def begin_connection(self, on_alive=None):
+        """Reset the per-connection state before (re)connecting; on_alive runs once the stream is live."""
+        self.alive = False
+        self.resume_id = None
+        self._on_alive = on_alive
+
+    def mark_alive(self, status_id=None):
+        if status_id is not None and self.resume_id is None:
+            self.resume_id = status_id
+        if not self.alive:
+            self.alive = True
+            if self._on_alive is not None:
+                self._on_alive()
+
+    def store(self, status):
+        status_data = build_status_document(status)
+
+        # Queue the status data for the next batched MongoDB write
+        self.metrics.record_received()
+        self.writer.put(status_data)
+
+        if self.last_status_id is None or status_data['id'] > self.last_status_id:
+            self.last_status_id = status_data['id']
+        return status_data
+
+    def store_many(self, statuses):
+        for status in statuses:
+            self.store(status)
+
+    def handle_heartbeat(self):
+        self.mark_alive()
+
+    def on_update(self, status):
+        status_data = self.store(status)
+        self.mark_alive(status_data['id'])
+        self.metrics.record_lag(status_data['created_at'])
 
-        print(f"Saved update to MongoDB collection {self.collection.name}: {status_data}")
+        self.status_log.hit(collection=self.collection.name, last_id=status_data['id'])
 
 
 def start_stream_for_instance(instance_config):
+    recovery_config = Config.get_recovery_config()
     mastodon = Mastodon(
         access_token=instance_config["access_token"],
         api_base_url=instance_config["base_url"]
     )
     listener = MastodonListener(instance_config["collection_name"])
+    backfiller = Backfiller(mastodon, listener,
+                            concurrency=recovery_config['backfill_concurrency'],
+                            max_pages=recovery_config['backfill_max_pages'])
+    backoff = Backoff(recovery_config['backoff_base'], recovery_config['backoff_max'])
 
     while True:
+        # Once the new connection is live, fetch whatever was posted since the last stored status
+        since_id = listener.last_status_id
+        listener.begin_connection(on_alive=(lambda: backfiller.start(since_id)) if since_id is not None else None)
         try:
             mastodon.stream_public(listener, local=True)
         except Exception as e:
-            print(f"Error in streaming for {instance_config['base_url']}: {e}")
+            log_event("stream_error", logging.WARNING, instance=instance_config['base_url'], error=str(e))
 
+        if listener.alive:
+            backoff.reset()
+        delay = backoff.next_delay()
+        listener.metrics.record_reconnect()
+        log_event("stream_reconnect", instance=instance_config['base_url'], delay_seconds=round(delay, 1))
+        time.sleep(delay)
@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+# Upper bounds (seconds) of the MongoDB write batch latency histogram
+WRITE_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Window (seconds) the statuses/sec rate is averaged over
+RATE_WINDOW = 60
+
+
+class InstanceMetrics:
+    """Thread-safe ingest counters for one Mastodon instance."""
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.buffer = None  # The writer's queue, read for the buffer depth gauge
+        self.spill = None   # The writer's SpillLog, read for the spill size gauge
+
+        self._lock = threading.Lock()
+        self._received = 0
+        self._written = 0
+        self._reconnects = 0
+        self._spilled = 0
+        self._lag_seconds = None
+        self._latency_counts = [0] * (len(WRITE_LATENCY_BUCKETS) + 1)
+        self._latency_sum = 0.0
+        self._per_second = deque()  # [unix second, statuses received in it]
+
+    def record_received(self, count=1):
+        second = int(time.time())
+        with self._lock:
+            self._received += count
+            if self._per_second and self._per_second[-1][0] == second:
+                self._per_second[-1][1] += count
+            else:
+                self._per_second.append([second, count])
+            while self._per_second[0][0] <= second - RATE_WINDOW:
+                self._per_second.popleft()
+
+    def record_lag(self, created_at):
+        lag = (datetime.now(timezone.utc) - created_at).total_seconds()
+        with self._lock:
+            self._lag_seconds = lag
+
+    def record_written(self, count, latency_seconds):
+        bucket = len(WRITE_LATENCY_BUCKETS)
+        for i, upper_bound in enumerate(WRITE_LATENCY_BUCKETS):
+            if latency_seconds <= upper_bound:
+                bucket = i
+                break
+        with self._lock:
+            self._written += count
+            self._latency_counts[bucket] += 1
+            self._latency_sum += latency_seconds
+
+    def record_spilled(self, count):
+        with self._lock:
+            self._spilled += count
+
+    def record_reconnect(self):
+        with self._lock:
+            self._reconnects += 1
+
+    def snapshot(self):
+        now = int(time.time())
+        with self._lock:
+            recent = sum(count for second, count in self._per_second if second > now - RATE_WINDOW)
+            return {
+                'statuses_per_second': round(recent / RATE_WINDOW, 3),
+                'received_total': self._received,
+                'written_total': self._written,
+                'buffer_depth': self.buffer.qsize() if self.buffer is not None else 0,
+                'reconnects_total': self._reconnects,
+                'spilled_total': self._spilled,
+                'spill_bytes': self.spill.size if self.spill is not None else 0,
+                'spill_dropped_total': self.spill.dropped if self.spill is not None else 0,
+                'ingest_lag_seconds': self._lag_seconds,
+                'write_latency_seconds': {
+                    'buckets': list(WRITE_LATENCY_BUCKETS),
+                    'counts': list(self._latency_counts),
+                    'sum': self._latency_sum
+                }
+            }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def get(self, instance):
+        with self._lock:
+            if instance not in self._instances:
+                self._instances[instance] = InstanceMetrics(instance)
+            return self._instances[instance]
+
+    def snapshot(self):
+        with self._lock:
+            instances = list(self._instances.values())
+        return {metrics.instance: metrics.snapshot() for metrics in instances}
+
+
+# Process-wide registry shared by listeners, writers and the Flask app
+registry = MetricsRegistry()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(snapshot):
+    """Render a registry snapshot in the Prometheus text exposition format."""
+    simple_metrics = [
+        ('mastodon_statuses_per_second', 'gauge', 'Statuses received per second over the last minute', 'statuses_per_second'),
+        ('mastodon_statuses_received_total', 'counter', 'Statuses received from the stream and backfill', 'received_total'),
+        ('mastodon_statuses_written_total', 'counter', 'New statuses written to MongoDB', 'written_total'),
+        ('mastodon_write_buffer_depth', 'gauge', 'Statuses waiting in the write buffer', 'buffer_depth'),
+        ('mastodon_reconnects_total', 'counter', 'Stream reconnects', 'reconnects_total'),
+        ('mastodon_statuses_spilled_total', 'counter', 'Statuses spilled to local disk', 'spilled_total'),
+        ('mastodon_spill_bytes', 'gauge', 'Bytes of spilled statuses waiting to be replayed', 'spill_bytes'),
+        ('mastodon_spill_dropped_total', 'counter', 'Statuses dropped because the spill directory was full', 'spill_dropped_total'),
+        ('mastodon_ingest_lag_seconds', 'gauge', 'Wall clock minus created_at of the last streamed status', 'ingest_lag_seconds'),
+    ]
+
+    lines = []
+    for name, metric_type, help_text, key in simple_metrics:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for instance, values in sorted(snapshot.items()):
+            if values[key] is not None:
+                lines.append(f'{name}{{instance="{_escape(instance)}"}} {values[key]}')
+
+    name = 'mastodon_write_batch_latency_seconds'
+    lines.append(f'# HELP {name} Latency of MongoDB write batches')
+    lines.append(f'# TYPE {name} histogram')
+    for instance, values in sorted(snapshot.items()):
+        histogram = values['write_latency_seconds']
+        label = f'instance="{_escape(instance)}"'
+        cumulative = 0
+        for upper_bound, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label},le="{upper_bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{label}}} {histogram["sum"]}')
+        lines.append(f'{name}_count{{{label}}} {cumulative}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,75 @@
+"""Migrate raw status collections to native BSON datetimes, deduplicate them and create their indexes.
+
+Usage (inside the flask-app container):
+    python migrate.py [--batch-size 1000] [--collection https://mastodon.social]
+
+Documents written before the streamer switched to datetimes store created_at as an
+ISO string. They are rewritten in _id order, one batch at a time, and every update
+matches on the original string, so running this while ingestion continues is safe
+and the migration can be interrupted and restarted at any point.
+
+Duplicate copies of a status id are removed before the unique id index is built,
+replacing the plain id index the streamer falls back to while duplicates exist.
+Compact (time-series) collections were written with datetimes from the start and
+can't carry a unique index, so only their indexes are ensured.
+"""
+import argparse
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from mastodon_listener import get_database
+from raw_schema import COMPACT, collection_layout, ensure_indexes, remove_duplicates
+
+
+def migrate_created_at(collection, batch_size):
+    converted, last_id = 0, None
+    while True:
+        query = {"created_at": {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(collection.find(query, {"_id": 1, "created_at": 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            return converted
+
+        requests = []
+        for doc in batch:
+            try:
+                created_at = datetime.fromisoformat(doc["created_at"].replace("Z", "+00:00"))
+            except ValueError:
+                print(f"Skipping {doc['_id']} in {collection.name}: unparseable created_at {doc['created_at']!r}")
+                continue
+            requests.append(UpdateOne(
+                {"_id": doc["_id"], "created_at": doc["created_at"]},
+                {"$set": {"created_at": created_at}}
+            ))
+
+        if requests:
+            converted += collection.bulk_write(requests, ordered=False).modified_count
+        last_id = batch[-1]["_id"]
+        print(f"{collection.name}: converted {converted} documents so far")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert created_at to BSON datetimes, remove duplicate statuses and create raw collection indexes.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--collection", action="append", help="Only migrate this collection (repeatable)")
+    args = parser.parse_args()
+
+    db = get_database()
+    # Skip the system.buckets.* collections behind time-series collections
+    collection_names = args.collection or db.list_collection_names(filter={"name": {"$not": {"$regex": r"^system\."}}})
+    for collection_name in collection_names:
+        collection = db[collection_name]
+        if collection_layout(db, collection_name) == COMPACT:
+            ensure_indexes(collection, COMPACT)
+            print(f"{collection_name}: compact time-series collection, indexes ensured")
+            continue
+        converted = migrate_created_at(collection, args.batch_size)
+        removed = remove_duplicates(collection, args.batch_size)
+        ensure_indexes(collection, replace_fallback=True)
+        print(f"{collection_name}: converted {converted} documents, removed {removed} duplicates, indexes ensured")
+
+
+if __name__ == "__main__":
+    main()
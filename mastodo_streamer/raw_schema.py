@@ -0,0 +1,118 @@
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+# Raw collections come in two layouts. LEGACY is a regular collection with the long
+# field names written by on_update. COMPACT is a time-series collection keyed on the
+# status time, with short field names, the always-null username dropped and the
+# instance as the time-series metadata (stored once per bucket, not per status).
+LEGACY = "legacy"
+COMPACT = "compact"
+
+COMPACT_FIELDS = {
+    'id': 'i',
+    'created_at': 't',
+    'user_id': 'u',
+    'user_bot': 'b',
+    'visibility': 'v',
+    'language': 'l'
+}
+COMPACT_META_FIELD = 'm'
+
+# Indexes every raw status collection should have. The analytics job filters on
+# created_at ranges and counts distinct user_id values inside them, so the compound
+# index covers both its range scans and its distinct user counts.
+RAW_INDEXES = {
+    LEGACY: [
+        ([("created_at", ASCENDING), ("user_id", ASCENDING)], {"name": "created_at_user_id"}),
+        # Reconnect backfill and restarts can deliver a status twice; the unique key makes writes idempotent
+        ([("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ],
+    COMPACT: [
+        ([("t", ASCENDING), ("u", ASCENDING)], {"name": "t_u"}),
+        # Time-series collections can't have unique indexes; the writer looks ids up before inserting
+        ([("i", ASCENDING)], {"name": "i"}),
+    ]
+}
+# Stands in for id_unique while duplicate statuses keep it from being built, so upserts on id stay indexed
+FALLBACK_ID_INDEX = ([("id", ASCENDING)], {"name": "id"})
+
+
+def collection_layout(db, collection_name):
+    """Layout of an existing collection, or None if it doesn't exist yet."""
+    for info in db.list_collections(filter={"name": collection_name}):
+        timeseries = info.get("options", {}).get("timeseries")
+        if timeseries and timeseries.get("timeField") == COMPACT_FIELDS['created_at']:
+            return COMPACT
+        return LEGACY
+    return None
+
+
+def prepare_collection(db, collection_name, compact):
+    """Return the layout to write collection_name in, creating it as a time-series collection if compact.
+
+    Existing collections keep their layout, so turning compact storage on only
+    affects instances whose collection doesn't exist yet.
+    """
+    layout = collection_layout(db, collection_name)
+    if layout is None and compact:
+        db.create_collection(collection_name, timeseries={
+            "timeField": COMPACT_FIELDS['created_at'],
+            "metaField": COMPACT_META_FIELD,
+            "granularity": "seconds"
+        })
+        return COMPACT
+    return layout or LEGACY
+
+
+def to_compact(document, instance):
+    compact = {short: document[field] for field, short in COMPACT_FIELDS.items()}
+    compact[COMPACT_META_FIELD] = instance
+    return compact
+
+
+def ensure_indexes(collection, layout=LEGACY, replace_fallback=False):
+    """Create the raw collection indexes; a no-op for indexes that already exist.
+
+    If duplicate statuses keep the unique id index from being built, the plain
+    FALLBACK_ID_INDEX is created instead and DuplicateKeyError is raised once the
+    other indexes exist. An existing fallback is only swapped for the unique index
+    with replace_fallback, i.e. after remove_duplicates; otherwise every writer
+    start would retry the failing build on the whole collection.
+    """
+    fallback_keys, fallback_options = FALLBACK_ID_INDEX
+    existing = collection.index_information()
+    error = None
+    for keys, options in RAW_INDEXES[layout]:
+        if not options.get("unique") or options["name"] in existing:
+            collection.create_index(keys, **options)
+            continue
+        if fallback_options["name"] in existing:
+            if not replace_fallback:
+                error = DuplicateKeyError(f"{options['name']} not built yet, {fallback_options['name']} is used instead")
+                continue
+            # An index on the same keys under another name would conflict with the unique one
+            collection.drop_index(fallback_options["name"])
+        try:
+            collection.create_index(keys, **options)
+        except DuplicateKeyError as e:
+            collection.create_index(fallback_keys, **fallback_options)
+            error = e
+    if error is not None:
+        raise error
+
+
+def remove_duplicates(collection, batch_size=1000):
+    """Delete all but the first stored copy of every status id. Needed once before the unique index can be built."""
+    pipeline = [
+        {"$group": {"_id": "$id", "copies": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    removed, pending = 0, []
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        pending.extend(group["copies"][1:])
+        if len(pending) >= batch_size:
+            removed += collection.delete_many({"_id": {"$in": pending}}).deleted_count
+            pending = []
+    if pending:
+        removed += collection.delete_many({"_id": {"$in": pending}}).deleted_count
+    return removed
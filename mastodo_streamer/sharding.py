@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from config import Config
+from metrics import registry
+from structured_log import log_event
+
+
+def start_streams(instances_config, stream_config):
+    """Start streaming the given instances in this process, in the configured mode."""
+    from async_streamer import AsyncStreamer
+    from mastodon_listener import start_stream_for_instance
+
+    if stream_config['mode'] == 'asyncio':
+        # All instances share one event loop thread instead of one blocked thread each
+        AsyncStreamer(instances_config, parse_workers=stream_config['parse_workers']).start()
+        return
+
+    for instance_config in instances_config:
+        stream_thread = threading.Thread(target=start_stream_for_instance, args=(instance_config,), name=instance_config['base_url'])
+        stream_thread.daemon = True
+        stream_thread.start()
+
+
+def shard_for(base_url, num_shards):
+    # md5 rather than hash(): str hashes are salted per process, the assignment has to survive restarts
+    digest = hashlib.md5(base_url.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def split_instances(instances_config, num_shards):
+    shards = [[] for _ in range(num_shards)]
+    for instance_config in instances_config:
+        shards[shard_for(instance_config['base_url'], num_shards)].append(instance_config)
+    return shards
+
+
+def run_worker(shard_index, instances_config, stream_config, metrics_queue, report_interval):
+    """Entry point of a worker process: stream one shard and report its metrics to the supervisor."""
+    # force: spawn re-imports app.py as __mp_main__, whose own basicConfig has already installed a handler
+    logging.basicConfig(level=Config.get_logging_config()['level'], force=True,
+                        format=f"%(asctime)s %(levelname)s %(name)s[shard {shard_index}] %(message)s")
+    start_streams(instances_config, stream_config)
+    log_event("worker_started", shard=shard_index, pid=os.getpid(), instances=len(instances_config))
+
+    while True:
+        time.sleep(report_interval)
+        metrics_queue.put((shard_index, registry.snapshot()))
+
+
+class ShardSupervisor:
+    """Runs the instance shards in worker processes, restarts dead workers and merges their metrics.
+
+    Every instance is assigned to a shard by a stable hash of its base_url, so an
+    instance always lands in the same worker across restarts.
+    """
+
+    def __init__(self, instances_config, num_workers, stream_config, check_interval=5.0, report_interval=5.0):
+        self.shards = split_instances(instances_config, num_workers)
+        self.stream_config = stream_config
+        self.check_interval = check_interval
+        self.report_interval = report_interval
+
+        # spawn: workers start from a clean interpreter instead of inheriting MongoClients and threads through fork
+        self._context = multiprocessing.get_context("spawn")
+        self._metrics_queue = self._context.Queue()
+        self._processes = {}
+        self._restarts = {shard_index: 0 for shard_index in range(num_workers)}
+        self._worker_metrics = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        for shard_index, instances_config in enumerate(self.shards):
+            if instances_config:
+                self._start_worker(shard_index)
+        threading.Thread(target=self._supervise, name="shard-supervisor", daemon=True).start()
+        threading.Thread(target=self._collect_metrics, name="shard-metrics", daemon=True).start()
+
+    def _start_worker(self, shard_index):
+        process = self._context.Process(
+            target=run_worker,
+            args=(shard_index, self.shards[shard_index], self.stream_config, self._metrics_queue, self.report_interval),
+            name=f"stream-worker-{shard_index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[shard_index] = process
+
+    def _supervise(self):
+        while True:
+            time.sleep(self.check_interval)
+            for shard_index, process in list(self._processes.items()):
+                if not process.is_alive():
+                    log_event("worker_died", logging.WARNING, shard=shard_index, exitcode=process.exitcode)
+                    self._restarts[shard_index] += 1
+                    self._start_worker(shard_index)
+
+    def _collect_metrics(self):
+        while True:
+            try:
+                shard_index, snapshot = self._metrics_queue.get(timeout=self.report_interval * 2)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self._worker_metrics[shard_index] = snapshot
+
+    def snapshot(self):
+        """Merged per-instance metrics of all workers; every instance belongs to exactly one shard."""
+        merged = {}
+        with self._lock:
+            for snapshot in self._worker_metrics.values():
+                merged.update(snapshot)
+        return merged
+
+    def workers(self):
+        return [{
+            "shard": shard_index,
+            "pid": process.pid,
+            "is_alive": process.is_alive(),
+            "restarts": self._restarts[shard_index],
+            "instances": [instance_config['base_url'] for instance_config in self.shards[shard_index]]
+        } for shard_index, process in sorted(self._processes.items())]
@@ -0,0 +1,102 @@
+import glob
+import os
+import re
+import threading
+import time
+
+import bson
+from bson.errors import InvalidBSON
+
+ACTIVE_SUFFIX = ".open"
+SEALED_SUFFIX = ".seg"
+
+
+def spill_directory(base_directory, collection_name):
+    # Collection names are instance URLs; keep one directory per instance with a filesystem-safe name
+    return os.path.join(base_directory, re.sub(r"[^A-Za-z0-9._-]", "_", collection_name))
+
+
+class SpillLog:
+    """Append-only segment files for statuses that could not be written to MongoDB.
+
+    Records are plain BSON documents written back to back; BSON documents carry
+    their own length prefix, so a segment needs no extra framing and a torn last
+    record after a crash is simply dropped on read. New records go to the active
+    `.open` segment, which is sealed into a `.seg` file once it reaches
+    `segment_bytes` or when the replayer wants to drain it. Appends are refused
+    (and counted as dropped) once the directory holds `max_bytes`.
+    """
+
+    def __init__(self, directory, max_bytes, segment_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_size = 0
+
+        # A segment left open by a crash is complete up to its last whole record
+        for path in glob.glob(os.path.join(directory, "*" + ACTIVE_SUFFIX)):
+            os.replace(path, path[:-len(ACTIVE_SUFFIX)] + SEALED_SUFFIX)
+        self._size = sum(os.path.getsize(path) for path in self.sealed_segments())
+
+    @property
+    def size(self):
+        return self._size
+
+    def append(self, documents):
+        """Append documents to the active segment; returns False if the disk cap would be exceeded."""
+        data = b"".join(bson.encode(document) for document in documents)
+        with self._lock:
+            if self._size + len(data) > self.max_bytes:
+                self.dropped += len(documents)
+                return False
+            if self._active is None:
+                self._active = open(os.path.join(self.directory, f"{time.time_ns():020d}{ACTIVE_SUFFIX}"), "ab")
+                self._active_size = 0
+            self._active.write(data)
+            self._active.flush()
+            self._active_size += len(data)
+            self._size += len(data)
+            if self._active_size >= self.segment_bytes:
+                self._seal_active()
+            return True
+
+    def seal(self):
+        """Seal the active segment so it can be replayed."""
+        with self._lock:
+            self._seal_active()
+
+    def _seal_active(self):
+        if self._active is None:
+            return
+        path = self._active.name
+        os.fsync(self._active.fileno())
+        self._active.close()
+        self._active = None
+        os.replace(path, path[:-len(ACTIVE_SUFFIX)] + SEALED_SUFFIX)
+
+    def sealed_segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, "*" + SEALED_SUFFIX)))
+
+    @staticmethod
+    def read_segment(path):
+        documents = []
+        with open(path, "rb") as segment:
+            try:
+                for document in bson.decode_file_iter(segment):
+                    documents.append(document)
+            except InvalidBSON:
+                pass  # torn tail of a segment that was being written during a crash
+        return documents
+
+    def remove(self, path):
+        with self._lock:
+            self._size -= os.path.getsize(path)
+            os.remove(path)
+
+    def close(self):
+        self.seal()
@@ -0,0 +1,373 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+from raw_schema import COMPACT, LEGACY, ensure_indexes, to_compact
+from spill import SpillLog
+from structured_log import log_event, RateLimitedLog
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class RecentIds:
+    """Bounded, thread-safe set of the most recently seen status ids."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, status_id):
+        """Remember status_id; returns False if it was already seen recently."""
+        with self._lock:
+            if status_id in self._ids:
+                self._ids.move_to_end(status_id)
+                return False
+            self._ids[status_id] = None
+            if len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+            return True
+
+
+class StatusWriter:
+    """Write-behind buffer that flushes statuses to MongoDB in unordered batches.
+
+    Statuses are put on a bounded in-memory queue by the stream thread and a
+    background writer thread drains them with one unordered bulk upsert keyed on
+    the status id, either when a batch reaches `batch_size` or when
+    `flush_interval` seconds have passed since the first status of the batch
+    arrived. Ids seen recently are dropped before they are queued, and anything
+    that still slips through (e.g. after a restart) is absorbed by the upsert.
+
+    With a SpillLog attached, statuses that don't fit into the full queue, and
+    batches that can't be written because MongoDB is unreachable, go to local
+    disk instead. The process-wide SpillReplayer drains the spilled segments
+    back into MongoDB in large batches once it answers pings again.
+
+    Compact (time-series) collections can't be upserted into or carry a unique
+    index, so there each batch looks its ids up and inserts only the new ones.
+
+    With a LiveStats attached, every status stored for the first time is also
+    counted into the live per-day and per-hour analytics.
+
+    With a SharedWriter, the writer gets no thread of its own and the shared
+    thread batches and flushes its queue together with those of other instances.
+    """
+
+    def __init__(self, collection, batch_size=500, flush_interval=1.0, max_queue_size=10000, dedupe_cache_size=10000,
+                 metrics=None, spill=None, replay_batch_size=5000, replay_interval=5.0, layout=LEGACY,
+                 live_stats=None, shared=None):
+        self.collection = collection
+        self.layout = layout
+        self.metrics = metrics
+        self.live_stats = live_stats
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.recent_ids = RecentIds(dedupe_cache_size)
+        self.flush_log = RateLimitedLog("batches_flushed")
+        if metrics is not None:
+            metrics.buffer = self.queue
+
+        self.spill = spill
+        self.replay_batch_size = replay_batch_size
+        self.replay_interval = replay_interval
+        self.spill_full_log = RateLimitedLog("spill_full", level=logging.ERROR)
+        self._mongo_down = threading.Event()
+        if spill is not None and metrics is not None:
+            metrics.spill = spill
+
+        self._stopped = threading.Event()
+        self.shared = shared
+        if shared is not None:
+            # One collection's index build must not stall the shared thread, so it runs on the creating thread
+            self._ensure_indexes()
+            self._pending = []
+            self._pending_since = None
+            self._closed = threading.Event()
+            shared.add(self)
+        else:
+            self._thread = threading.Thread(target=self._run, name=f"writer:{collection.name}", daemon=True)
+            self._thread.start()
+        if spill is not None:
+            spill_replayer(replay_interval).add(self)
+
+    def put(self, document):
+        """Queue a status document; returns False if it was skipped as a recent duplicate."""
+        if not self.recent_ids.add(document['id']):
+            return False
+        if self.layout == COMPACT:
+            document = to_compact(document, self.collection.name)
+        if self.spill is None:
+            # Blocks while the queue is full, so a slow MongoDB slows the reader down instead of growing memory
+            self.queue.put(document)
+        else:
+            try:
+                self.queue.put_nowait(document)
+            except queue.Full:
+                # MongoDB can't keep up: park the status on disk instead of stalling the stream reader
+                self._spill([document])
+                return True
+        if self.shared is not None:
+            # Wake the shared thread when a batch starts or fills; otherwise it is already waiting for the deadline
+            queued = self.queue.qsize()
+            if queued == 1 or queued >= self.batch_size:
+                self.shared.notify()
+        return True
+
+    def close(self, timeout=None):
+        """Stop the writer thread after the remaining queue has been flushed."""
+        self._stopped.set()
+        if self.shared is not None:
+            self.shared.notify()
+            self._closed.wait(timeout)
+        else:
+            self._thread.join(timeout)
+        if self.spill is not None:
+            spill_replayer(self.replay_interval).remove(self)
+            self.spill.close()
+
+    def _ensure_indexes(self):
+        try:
+            ensure_indexes(self.collection, self.layout)
+        except Exception as e:
+            log_event("index_error", logging.ERROR, collection=self.collection.name, error=str(e),
+                      hint="run migrate.py to remove duplicate statuses; upserts use a plain id index until then")
+
+    def _run(self):
+        # Runs on the writer thread so an index build on a large collection never stalls the stream reader
+        self._ensure_indexes()
+        while not (self._stopped.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+            if self.live_stats is not None:
+                self.live_stats.publish_if_due()
+
+    def _service(self):
+        """One pass of the shared thread: take queued statuses and flush them if due; returns seconds until the next pass."""
+        while len(self._pending) < self.batch_size:
+            try:
+                document = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append(document)
+
+        wait = self.flush_interval
+        if self._pending:
+            wait = self._pending_since + self.flush_interval - time.monotonic()
+            if len(self._pending) >= self.batch_size or wait <= 0 or self._stopped.is_set():
+                batch, self._pending = self._pending, []
+                self._flush(batch)
+                wait = 0 if not self.queue.empty() else self.flush_interval
+        elif self._stopped.is_set() and self.queue.empty():
+            self._closed.set()
+        if self.live_stats is not None:
+            self.live_stats.publish_if_due()
+        return wait
+
+    def _next_batch(self):
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, documents):
+        """Upsert documents in one unordered bulk write; returns the number of new statuses."""
+        started = time.perf_counter()
+        if self.layout == COMPACT:
+            new_documents = self._insert_new(documents)
+        else:
+            new_documents = self._upsert(documents)
+        elapsed = time.perf_counter() - started
+        if self.metrics is not None:
+            self.metrics.record_written(len(new_documents), elapsed)
+        if self.live_stats is not None and new_documents:
+            self._record_live_stats(new_documents)
+        return len(new_documents), elapsed
+
+    def _upsert(self, documents):
+        requests = [UpdateOne({'id': document['id']}, {'$setOnInsert': document}, upsert=True) for document in documents]
+        try:
+            upserted = self.collection.bulk_write(requests, ordered=False).upserted_ids
+        except BulkWriteError as e:
+            # Concurrent upserts of the same id can race into a duplicate key error; the status is stored either way
+            errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != DUPLICATE_KEY_ERROR]
+            if errors:
+                log_event("write_partial", logging.WARNING, collection=self.collection.name, errors=len(errors), first_error=errors[0])
+            upserted = {entry['index']: entry['_id'] for entry in e.details.get('upserted', [])}
+        return [documents[index] for index in upserted]
+
+    def _record_live_stats(self, documents):
+        created_at_key, user_key = ('t', 'u') if self.layout == COMPACT else ('created_at', 'user_id')
+        try:
+            self.live_stats.record([(document[created_at_key], document[user_key]) for document in documents])
+        except Exception as e:
+            log_event("live_stats_error", logging.WARNING, collection=self.collection.name, error=str(e))
+
+    def _insert_new(self, documents):
+        ids = [document['i'] for document in documents]
+        existing = set(self.collection.distinct('i', {'i': {'$in': ids}}))
+        new_documents = [document for document in documents if document['i'] not in existing]
+        if new_documents:
+            self.collection.insert_many(new_documents, ordered=False)
+        return new_documents
+
+    def _flush(self, batch):
+        if self.spill is not None and self._mongo_down.is_set():
+            self._spill(batch)
+            return
+        try:
+            inserted, elapsed = self._write(batch)
+        except Exception as e:
+            log_event("write_error", logging.ERROR, collection=self.collection.name, batch_size=len(batch), error=str(e))
+            if self.spill is not None:
+                if isinstance(e, ConnectionFailure):
+                    self._mongo_down.set()
+                self._spill(batch)
+            return
+        self.flush_log.hit(collection=self.collection.name, batch_size=len(batch), inserted=inserted, elapsed_ms=round(elapsed * 1000, 1))
+
+    def _spill(self, documents):
+        if self.spill.append(documents):
+            if self.metrics is not None:
+                self.metrics.record_spilled(len(documents))
+        else:
+            self.spill_full_log.hit(collection=self.collection.name, dropped_total=self.spill.dropped)
+
+    def _replay_spill(self):
+        """Write the spilled segments back to MongoDB; called by the SpillReplayer once MongoDB answers."""
+        self._mongo_down.clear()
+        self.spill.seal()
+        for path in self.spill.sealed_segments():
+            documents = SpillLog.read_segment(path)
+            try:
+                for start in range(0, len(documents), self.replay_batch_size):
+                    self._write(documents[start:start + self.replay_batch_size])
+            except Exception as e:
+                # The segment stays on disk; replaying it again later is harmless because writes are upserts
+                log_event("spill_replay_error", logging.WARNING, collection=self.collection.name, segment=path, error=str(e))
+                if isinstance(e, ConnectionFailure):
+                    self._mongo_down.set()
+                break
+            self.spill.remove(path)
+            log_event("spill_replayed", collection=self.collection.name, statuses=len(documents))
+
+
+class SpillReplayer:
+    """One thread that replays the SpillLogs of every writer in the process.
+
+    Every `interval` seconds it pings each MongoDB client that has writers with
+    spilled statuses once, and if it answers, replays those writers' segments one
+    after the other.
+    """
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self._writers = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="spill-replayer", daemon=True)
+        self._thread.start()
+
+    def add(self, writer):
+        with self._lock:
+            self._writers.append(writer)
+
+    def remove(self, writer):
+        with self._lock:
+            if writer in self._writers:
+                self._writers.remove(writer)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                writers = [writer for writer in self._writers if writer.spill.size]
+            clients = {}
+            for writer in writers:
+                clients.setdefault(writer.collection.database.client, []).append(writer)
+            for client, client_writers in clients.items():
+                try:
+                    client.admin.command('ping')
+                except ConnectionFailure:
+                    continue
+                for writer in client_writers:
+                    writer._replay_spill()
+                    if writer._mongo_down.is_set():
+                        break  # Lost the connection again; wait for the next ping
+
+
+_spill_replayer = None
+_spill_replayer_lock = threading.Lock()
+
+
+def spill_replayer(interval=5.0):
+    # Started by the first writer with a spill; later writers share it and its interval
+    global _spill_replayer
+    with _spill_replayer_lock:
+        if _spill_replayer is None:
+            _spill_replayer = SpillReplayer(interval)
+    return _spill_replayer
+
+
+class SharedWriter:
+    """One writer thread for the StatusWriters of many instances.
+
+    Asyncio mode streams every instance from a single event loop, so a writer
+    thread per instance would bring back the threads it saves. Each StatusWriter
+    keeps its own queue, dedupe cache and batch settings; this thread cycles over
+    them and flushes a writer's batch once it is full or its oldest status has
+    waited flush_interval seconds. Writers are removed once they are closed and
+    drained.
+    """
+
+    def __init__(self, name="writer:shared"):
+        self._writers = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def add(self, writer):
+        with self._lock:
+            self._writers.append(writer)
+        self.notify()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                writers = list(self._writers)
+            wait = 1.0
+            for writer in writers:
+                try:
+                    wait = min(wait, writer._service())
+                except Exception as e:
+                    log_event("writer_error", logging.ERROR, collection=writer.collection.name, error=str(e))
+                if writer._closed.is_set():
+                    with self._lock:
+                        self._writers.remove(writer)
+            if wait > 0:
+                self._wakeup.wait(wait)
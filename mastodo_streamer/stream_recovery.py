@@ -0,0 +1,78 @@
+import logging
+import random
+import threading
+
+from structured_log import log_event
+
+# Largest page the Mastodon timeline API hands out
+TIMELINE_PAGE_SIZE = 40
+
+
+class Backoff:
+    """Jittered exponential backoff between reconnect attempts of one instance.
+
+    The n-th delay is drawn uniformly from the upper half of min(cap, base * 2**n),
+    so instances that dropped together don't reconnect in lockstep.
+    """
+
+    def __init__(self, base=1.0, cap=300.0):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.cap, self.base * 2 ** self.attempt)
+        if delay < self.cap:
+            self.attempt += 1  # Stops at the cap: 2**n would overflow a float after ~1000 attempts
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempt = 0
+
+
+def select_missed(page, stop_id=None, limit=TIMELINE_PAGE_SIZE):
+    """Split one min_id-paginated timeline page into missed statuses and the next min_id.
+
+    Returns (statuses oldest first, next min_id, done). Paging is done once the page
+    is short or reaches statuses the reconnected stream already delivered (stop_id).
+    """
+    if not page:
+        return [], None, True
+
+    statuses = sorted(page, key=lambda status: int(status['id']))
+    next_min_id = int(statuses[-1]['id'])
+    if stop_id is not None:
+        statuses = [status for status in statuses if int(status['id']) < stop_id]
+    done = len(page) < limit or len(statuses) < len(page)
+    return statuses, next_min_id, done
+
+
+class Backfiller:
+    """Pages through the local public timeline over REST to recover statuses missed while disconnected."""
+
+    def __init__(self, mastodon, listener, concurrency=1, max_pages=100):
+        self.mastodon = mastodon
+        self.listener = listener
+        self.max_pages = max_pages
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def start(self, since_id):
+        thread = threading.Thread(target=self._run, args=(since_id,), name=f"backfill:{self.listener.collection.name}")
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, since_id):
+        # Caps how many backfills of this instance can hit the REST API at once
+        with self._slots:
+            min_id, total = since_id, 0
+            try:
+                for _ in range(self.max_pages):
+                    page = self.mastodon.timeline_public(local=True, min_id=min_id, limit=TIMELINE_PAGE_SIZE)
+                    statuses, min_id, done = select_missed(page, self.listener.resume_id)
+                    self.listener.store_many(statuses)
+                    total += len(statuses)
+                    if done:
+                        break
+            except Exception as e:
+                log_event("backfill_error", logging.WARNING, collection=self.listener.collection.name, since_id=since_id, error=str(e))
+            log_event("backfill_done", collection=self.listener.collection.name, since_id=since_id, statuses=total)